@@ -1,52 +1,52 @@
+import os
+import json
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+
 import streamlit as st
-import pandas as pd
-import numpy as np
-import joblib
-from PIL import Image
-
-
-# Load model & encoders
-model = joblib.load("model.joblib")
-feature_encoders = joblib.load("feature_encoders.joblib")
-target_encoders = joblib.load("target_encoders.joblib")
-
-# to get the amount for given acres
-FERTILIZER_RANGES = {
-    "wheat": {
-        "N": {"low": (0, 10), "medium": (15, 20), "high": (25, 30)},
-        "P": {"low": (0, 5), "medium": (8, 12), "high": (15, 20)},
-        "K": {"low": (0, 5), "medium": (8, 12)}
-    },
-    "rice": {
-        "N": {"low": (0, 10), "medium": (15, 20), "high": (25, 30)},
-        "P": {"low": (0, 5), "medium": (8, 12), "high": (15, 20)},
-        "K": {"low": (0, 5), "medium": (8, 12)}
-    }
-}
-
-def compute_fertilizer_quantity(crop, nutrient, level, area):
-    min_kg, max_kg = FERTILIZER_RANGES[crop][nutrient][level]
-    return {
-        "per_acre": f"{min_kg}–{max_kg} kg/acre",
-        "total": f"{min_kg * area:.1f}–{max_kg * area:.1f} kg"
-    }
-
-#growth stage logic
-def get_wheat_stage(days):
-    if days <= 25:
-        return "early"
-    elif days <= 60:
-        return "mid"
-    else:
-        return "late"
-
-def get_rice_stage(days):
-    if days <= 20:
-        return "early"
-    elif days <= 50:
-        return "mid"
-    else:
-        return "late"
+
+import instrumentation
+from instrumentation import stage, profile
+
+# pandas, numpy and the model code are not imported here: the warm-up thread
+# imports them after the page is drawn, later imports are dictionary lookups
+
+
+def start_store():
+    # flat array forest, same predictions as model.joblib but much faster per row
+    # memory-mapped, so all app processes share the same pages
+    # new versions written by train_model.py are validated and swapped in without a restart
+    # FERT_REQUEST_LOG=<dir> logs every scored request for retraining (request_log.py)
+    from model_store import ModelStore
+    return ModelStore("model.flat", log_dir=os.environ.get("FERT_REQUEST_LOG")).start()
+
+# Load model & encoders once per process, shared by all sessions
+@st.cache_resource
+def warm_up():
+    # started at the end of the first run, so it never delays the first render
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="warm-up").submit(start_store)
+
+def current_model():
+    # one version for the whole request, even if a reload happens meanwhile
+    future = warm_up()
+    try:
+        return future.result().current
+    except Exception as e:
+        # a failed start is not kept, the next rerun starts the store again
+        warm_up.clear()
+        st.error(f"Model unavailable: {e}")
+        st.stop()
+
+@st.cache_resource
+def load_icon():
+    # icon.png is decoded from icon.avif once (python startup.py icon) and sent as is
+    if os.path.exists("icon.png"):
+        with open("icon.png", "rb") as f:
+            return f.read()
+    from PIL import Image
+    img = Image.open("icon.avif")
+    img.load()
+    return img
 
 #page config
 st.set_page_config(
@@ -58,12 +58,68 @@ st.title("🌾 Fertilizer Recommendation System")
 st.subheader("Punjab • Wheat & Rice")
 
 #sidebar
-img = Image.open("icon.avif")
-st.sidebar.image(img)
+st.sidebar.image(load_icon())
 
 st.sidebar.markdown("**Focus:** Wheat & Rice (Punjab)")
 st.sidebar.markdown("---")
 st.sidebar.markdown("Advisory tool • No soil test required")
+st.sidebar.markdown("---")
+
+# rule engine gives the exact rule labels without running the forest
+engine = st.sidebar.selectbox("Prediction engine", ["Random Forest", "Rule engine"])
+
+# per request profiling, only offered when timing is on (FERT_TIMING=1)
+profile_kind = "off"
+if instrumentation.enabled():
+    profile_kind = st.sidebar.selectbox("Profile request", ["off", "cprofile", "sample"])
+
+mode = st.radio("Mode", ["Single field", "Batch upload (CSV)"], horizontal=True)
+
+# many fields at once, scored with one prediction call
+if mode == "Batch upload (CSV)":
+    st.markdown(
+        "Upload a CSV with one row per field and the columns: `crop`, "
+        "`days_since_start`, `soil_type`, `prev_N`, `prev_P`, `prev_K`, "
+        "`time_since_last_fertilizer`, `irrigation_count` (blank for rice), "
+        "`time_since_last_irrigation`, `last_irrigation_level`, `area_acres`. "
+        "Any other columns (field id, farmer, village) are kept in the result."
+    )
+    uploaded = st.file_uploader("Fields CSV", type="csv")
+
+    if uploaded is not None:
+        import pandas as pd
+        from rule_predictor import predict_batch
+        from recommendation import recommend_batch
+
+        # the rule engine does not wait for the model
+        forest = encoder = log = predictor = None
+        if engine == "Rule engine":
+            predictor = predict_batch
+        else:
+            current = current_model()
+            forest, encoder, log = current.forest, current.encoder, current.log
+
+        fields = pd.read_csv(uploaded, keep_default_na=False, na_values=[""])
+        try:
+            with stage("batch_request"):
+                results = recommend_batch(
+                    fields, forest, encoder, encoder, predictor=predictor, log=log
+                )
+        except ValueError as e:
+            st.error(str(e))
+            st.stop()
+
+        st.success(f"✅ Recommendations generated for {len(results)} fields")
+        st.dataframe(results)
+        st.download_button(
+            "Download results",
+            results.to_csv(index=False).encode("utf-8"),
+            file_name="fertilizer_recommendations.csv",
+            mime="text/csv"
+        )
+
+    warm_up()
+    st.stop()
 
 #inputs
 crop = st.selectbox("Crop", ["Wheat", "Rice"])
@@ -96,7 +152,7 @@ if crop == "Wheat":
         value=1
     )
 else:
-    irrigation_count = np.nan  # not applicable for rice
+    irrigation_count = float("nan")  # not applicable for rice
 
 time_since_irrigation = st.selectbox(
     "Time since last irrigation",
@@ -117,49 +173,32 @@ area = st.number_input(
 
 # now we will make the code to start prediction
 if st.button("Get Fertilizer Recommendation"):
-
-    # Growth stage
-    if crop == "Wheat":
-        growth_stage = get_wheat_stage(days)
-    else:
-        growth_stage = get_rice_stage(days)
-
-    
-    input_df = pd.DataFrame([{
-        "crop": crop.lower(),
-        "days_since_start": days,
-        "growth_stage": growth_stage,
-        "soil_type": soil_type.lower(),
-        "prev_N": prev_n.lower(),
-        "prev_P": prev_p.lower(),
-        "prev_K": prev_k.lower(),
-        "time_since_last_fertilizer": time_since_fert,
-        "irrigation_count": irrigation_count,
-        "time_since_last_irrigation": time_since_irrigation,
-        "last_irrigation_level": irrigation_level.lower(),
-        "area_acres": area
-    }])
-
-    # Handle NaN irrigation count only for (rice)
-    input_df["irrigation_count"] = input_df["irrigation_count"].fillna(-1)
-
-    # Encode features
-    for col, encoder in feature_encoders.items():
-        input_df[col] = encoder.transform(input_df[col].astype(str))
-
-    # Predict
-    prediction = model.predict(input_df)[0]
-
-    # Decode outputs
-    N = target_encoders["N_class"].inverse_transform([prediction[0]])[0]
-    P = target_encoders["P_class"].inverse_transform([prediction[1]])[0]
-    K = target_encoders["K_class"].inverse_transform([prediction[2]])[0]
-
-    crop_key = crop.lower()
-
-    N_qty = compute_fertilizer_quantity(crop_key, "N", N, area)
-    P_qty = compute_fertilizer_quantity(crop_key, "P", P, area)
-    K_qty = compute_fertilizer_quantity(crop_key, "K", K, area)
+    from rule_predictor import predict_one
+    from recommendation import compute_fertilizer_quantity
+
+    profile_result = {}
+    profiling = nullcontext() if profile_kind == "off" else profile(profile_kind, profile_result)
+
+    with profiling, stage("request"):
+        if engine == "Rule engine":
+            result = predict_one(
+                crop, days, soil_type, prev_n, prev_p, prev_k,
+                time_since_fert, time_since_irrigation, irrigation_level,
+                -1 if crop == "Rice" else irrigation_count
+            )
+            N, P, K = result["N"], result["P"], result["K"]
+        else:
+            N, P, K = current_model().predictor.predict(
+                crop, days, soil_type, prev_n, prev_p, prev_k, time_since_fert,
+                irrigation_count, time_since_irrigation, irrigation_level, area
+            )
+
+        crop_key = crop.lower()
+
+        with stage("quantities"):
+            N_qty = compute_fertilizer_quantity(crop_key, "N", N, area)
+            P_qty = compute_fertilizer_quantity(crop_key, "P", P, area)
+            K_qty = compute_fertilizer_quantity(crop_key, "K", K, area)
 
     # output 
     st.success("✅ Fertilizer Recommendation Generated")
@@ -188,3 +227,58 @@ if st.button("Get Fertilizer Recommendation"):
         "This is an advisory recommendation based on crop stage, soil type, "
         "and field history. Soil testing is recommended for precision."
     )
+
+    if profile_result:
+        with st.expander("Request profile"):
+            st.code(profile_result["report"])
+
+# every day of the season for the same field, one batched prediction
+if st.button("Show season schedule"):
+    from rule_predictor import predict_batch
+    from recommendation import normalize_field, season_schedule
+
+    field = (
+        crop, days, soil_type, prev_n, prev_p, prev_k, time_since_fert,
+        irrigation_count, time_since_irrigation, irrigation_level, area
+    )
+    with stage("schedule"):
+        if engine == "Rule engine":
+            schedule = season_schedule(normalize_field(*field), predict_batch)
+        else:
+            # cached per field profile, the days input does not change it
+            schedule = current_model().predictor.schedule(*field)
+
+    st.markdown("### 📅 Season schedule")
+    now = schedule[(schedule["from_day"] <= days) & (schedule["to_day"] >= days)]
+    st.caption(
+        f"Day {days} is in the {now['growth_stage'].iloc[0]} stage window "
+        f"(days {now['from_day'].iloc[0]}–{now['to_day'].iloc[0]})"
+    )
+    st.dataframe(schedule, hide_index=True)
+
+# everything above is drawn, now load the model in the background
+warm = warm_up()
+if warm.done() and warm.exception() is not None:
+    # the next rerun tries again
+    warm_up.clear()
+    st.sidebar.caption(f"Model unavailable: {warm.exception()}")
+elif warm.done():
+    current = warm.result().current
+    cache = current.predictor.cache_info()
+    st.sidebar.caption(f"Model version {current.version}")
+    st.sidebar.caption(
+        f"Prediction cache: {cache.hits} hits • {cache.misses} misses • "
+        f"{cache.currsize}/{cache.maxsize} entries"
+    )
+else:
+    st.sidebar.caption("Model loading…")
+
+if instrumentation.enabled():
+    with st.sidebar.expander("Stage timings"):
+        st.code(instrumentation.summary())
+        st.download_button(
+            "Export timings",
+            json.dumps(instrumentation.snapshot(), indent=2),
+            file_name="stage_timings.json",
+            mime="application/json"
+        )
@@ -0,0 +1,299 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import statistics
+
+import numpy as np
+import pandas as pd
+import joblib
+import sklearn
+
+import coding_wheat
+import rice_dataset_making
+import merging_data
+import train_model
+import fast_generator
+from recommendation import build_features, TARGET_COLS
+from fast_encoder import loop_encode, loop_decode
+
+'''
+Micro-benchmark suite.
+Runs every benchmark on freshly generated, seeded data in a temp folder and
+writes the timings as json. With --baseline the run is compared against a
+stored result and slower benchmarks are flagged (exit code 1).
+
+    python benchmarks.py --output bench.json
+    python benchmarks.py --baseline bench.json --tolerance 0.25
+'''
+
+BENCHMARKS = []
+
+
+def benchmark(name, repeat=5, rows=None):
+    # func(ctx) does the setup and returns the callable that gets timed
+    def decorator(func):
+        BENCHMARKS.append((name, func, repeat, rows))
+        return func
+    return decorator
+
+
+def prepare(workdir, n_rows):
+    # seeded data and one trained model that the other benchmarks use
+    random.seed(0)
+    coding_wheat.generate_wheat_dataset(n_rows).to_csv("wheat_fertilizer_dataset.csv", index=False)
+    rice_dataset_making.generate_rice_dataset(n_rows).to_csv("rice_fertilizer_dataset.csv", index=False)
+    merging_data.concat_datasets(
+        "wheat_fertilizer_dataset.csv",
+        "rice_fertilizer_dataset.csv"
+    ).to_csv("final_dataset.csv", index=False)
+
+    model, label_encoders, target_encoders, X_test, _ = train_model.train()
+    train_model.save_artifacts(model, label_encoders, target_encoders, X_test.columns)
+
+    data = pd.read_csv("final_dataset.csv")
+    features = build_features(data)
+    prediction = np.column_stack([
+        target_encoders[col].transform(data[col]) for col in TARGET_COLS
+    ])
+    return {
+        "workdir": workdir,
+        "n_rows": n_rows,
+        "model": model,
+        "feature_encoders": label_encoders,
+        "target_encoders": target_encoders,
+        "features": features,
+        "prediction": prediction
+    }
+
+
+# ---- benchmarks ----
+
+@benchmark("generate_wheat_rows", repeat=3, rows=3000)
+def bench_generate_wheat(ctx):
+    return lambda: coding_wheat.generate_wheat_dataset(3000)
+
+
+@benchmark("generate_rice_rows", repeat=3, rows=3000)
+def bench_generate_rice(ctx):
+    return lambda: rice_dataset_making.generate_rice_dataset(3000)
+
+
+@benchmark("generate_fast_rows", repeat=3, rows=1_000_000)
+def bench_generate_fast(ctx):
+    return lambda: fast_generator.generate_dataset("wheat", 1_000_000, seed=0)
+
+
+@benchmark("concat_datasets", repeat=5)
+def bench_concat(ctx):
+    return lambda: merging_data.concat_datasets(
+        "wheat_fertilizer_dataset.csv",
+        "rice_fertilizer_dataset.csv"
+    )
+
+
+@benchmark("train_full", repeat=1)
+def bench_train(ctx):
+    return train_model.train
+
+
+@benchmark("encode_1_row", repeat=200, rows=1)
+def bench_encode_one(ctx):
+    one = ctx["features"].iloc[:1]
+    return lambda: loop_encode(one, ctx["feature_encoders"])
+
+
+@benchmark("encode_batch", repeat=10)
+def bench_encode_batch(ctx):
+    return lambda: loop_encode(ctx["features"], ctx["feature_encoders"])
+
+
+@benchmark("predict_1_row", repeat=20, rows=1)
+def bench_predict_one(ctx):
+    X = loop_encode(ctx["features"].iloc[:1], ctx["feature_encoders"])
+    return lambda: ctx["model"].predict(X)
+
+
+@benchmark("predict_batch", repeat=5)
+def bench_predict_batch(ctx):
+    X = loop_encode(ctx["features"], ctx["feature_encoders"])
+    return lambda: ctx["model"].predict(X)
+
+
+@benchmark("decode_1_row", repeat=200, rows=1)
+def bench_decode_one(ctx):
+    pred = ctx["prediction"][:1]
+    return lambda: loop_decode(pred, ctx["target_encoders"])
+
+
+@benchmark("decode_batch", repeat=10)
+def bench_decode_batch(ctx):
+    return lambda: loop_decode(ctx["prediction"], ctx["target_encoders"])
+
+
+@benchmark("load_model_joblib", repeat=3)
+def bench_load_model(ctx):
+    return lambda: joblib.load("model.joblib")
+
+
+@benchmark("load_feature_encoders", repeat=20)
+def bench_load_feature_encoders(ctx):
+    return lambda: joblib.load("feature_encoders.joblib")
+
+
+@benchmark("load_target_encoders", repeat=20)
+def bench_load_target_encoders(ctx):
+    return lambda: joblib.load("target_encoders.joblib")
+
+
+# ---- runner ----
+
+def time_call(func, repeat):
+    func()  # warm up
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def run(n_rows=3000, only=None):
+    cwd = os.getcwd()
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            ctx = prepare(workdir, n_rows)
+            for name, setup, repeat, rows in BENCHMARKS:
+                if only and name not in only:
+                    continue
+                times = time_call(setup(ctx), repeat)
+                rows = rows or 2 * n_rows
+                results[name] = {
+                    "median_s": statistics.median(times),
+                    "min_s": min(times),
+                    "repeat": repeat,
+                    "rows": rows,
+                    "rows_per_s": rows / statistics.median(times)
+                }
+                print(f"{name:<24}{results[name]['median_s'] * 1e3:>12.3f} ms")
+        finally:
+            os.chdir(cwd)
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "sklearn": sklearn.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "n_rows": n_rows
+        },
+        "results": results
+    }
+
+
+# ---- model layouts ----
+
+LAYOUTS = {
+    "multioutput": {"native": False, "per_crop": False},
+    "native": {"native": True, "per_crop": False},
+    "per_crop": {"native": False, "per_crop": True},
+    "per_crop_native": {"native": True, "per_crop": True}
+}
+
+
+def compare_layouts(n_rows=3000, n_estimators=200, max_depth=12):
+    # accuracy, latency and memory of every train_model layout on the same data
+    cwd = os.getcwd()
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            prepare(workdir, n_rows)
+            for name, options in LAYOUTS.items():
+                start = time.perf_counter()
+                model, label_encoders, _, X_test, y_test = train_model.train(
+                    n_estimators=n_estimators, max_depth=max_depth, **options
+                )
+                fit_s = time.perf_counter() - start
+                flat = train_model.export_flat(model, label_encoders, X_test.columns)
+
+                X = X_test.to_numpy(dtype=np.float32)
+                y_pred = flat.predict(X)
+                accuracy = (y_pred == y_test.to_numpy()).mean(axis=0)
+                joblib.dump(model, "layout.joblib")
+
+                # trees one row walks: per-target forests add up, routing picks one crop
+                trees = len(flat.roots)
+                results[name] = {
+                    "fit_s": fit_s,
+                    **{f"acc_{col}": float(a) for col, a in zip(TARGET_COLS, accuracy)},
+                    "trees_per_row": trees,
+                    "single_ms": statistics.median(time_call(lambda: flat.predict(X[:1]), 200)) * 1e3,
+                    "batch_ms": statistics.median(time_call(lambda: flat.predict(X), 3)) * 1e3,
+                    "flat_mb": sum(a.nbytes for a in flat.to_arrays().values()) / 1024 ** 2,
+                    "joblib_mb": os.path.getsize("layout.joblib") / 1024 ** 2
+                }
+        finally:
+            os.chdir(cwd)
+
+    print(pd.DataFrame(results).T.to_string(float_format="%.4f"))
+    return results
+
+
+def compare(current, baseline, tolerance):
+    # benchmarks slower than baseline * (1 + tolerance)
+    regressions = []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        ratio = result["median_s"] / base["median_s"]
+        flag = "REGRESSION" if ratio > 1 + tolerance else ""
+        print(f"{name:<24}{base['median_s'] * 1e3:>12.3f} ->"
+              f"{result['median_s'] * 1e3:>12.3f} ms  {ratio:5.2f}x  {flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the benchmark suite")
+    parser.add_argument("--rows", type=int, default=3000, help="rows per crop in the test dataset")
+    parser.add_argument("--only", nargs="*", help="run only these benchmarks")
+    parser.add_argument("--output", help="write results json here")
+    parser.add_argument("--baseline", help="compare against this results json")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--layouts", action="store_true",
+                        help="compare the train_model layouts (multi-output, native, per crop)")
+    parser.add_argument("--n-estimators", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.layouts:
+        results = compare_layouts(args.rows, args.n_estimators)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
+        sys.exit(0)
+
+    current = run(args.rows, args.only)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
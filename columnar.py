@@ -0,0 +1,169 @@
+import os
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+'''
+Columnar (Parquet/Arrow) data pipeline.
+Text columns are stored dictionary encoded (category in pandas), days and
+irrigation_count as small integers, so the generators, the merge and the
+trainer exchange compact typed files instead of CSV text.
+
+    python columnar.py generate 1000000     wheat/rice parquet files
+    python columnar.py merge                final_dataset.parquet (streaming)
+    python columnar.py report               CSV vs Parquet parse time, size, memory
+'''
+
+TEXT_COLS = [
+    "crop", "growth_stage", "soil_type", "prev_N", "prev_P", "prev_K",
+    "time_since_last_fertilizer", "time_since_last_irrigation",
+    "last_irrigation_level", "N_class", "P_class", "K_class"
+]
+
+#column order of final_dataset, same as merging_data.concat_datasets
+FINAL_COLS = [
+    "crop", "days_since_start", "growth_stage", "soil_type", "prev_N", "prev_P",
+    "prev_K", "time_since_last_fertilizer", "irrigation_count",
+    "time_since_last_irrigation", "last_irrigation_level", "area_acres",
+    "N_class", "P_class", "K_class"
+]
+
+DAY_COLUMNS = {"days_since_sowing", "days_since_transplanting", "days_since_start"}
+
+
+def _schema(columns):
+    import pyarrow as pa
+
+    fields = []
+    for col in columns:
+        if col in TEXT_COLS:
+            fields.append(pa.field(col, pa.dictionary(pa.int8(), pa.string())))
+        elif col in DAY_COLUMNS:
+            fields.append(pa.field(col, pa.int16()))
+        elif col == "irrigation_count":
+            fields.append(pa.field(col, pa.int8()))  # null for rice
+        elif col == "area_acres":
+            fields.append(pa.field(col, pa.float32()))
+        elif col == "weight":
+            fields.append(pa.field(col, pa.int32()))  # dedup_dataset.py row counts
+        else:
+            raise ValueError(f"No columnar type for column {col}")
+    return pa.schema(fields)
+
+
+def to_table(df):
+    # pandas (strings or categoricals) -> arrow table with the compact schema
+    import pyarrow as pa
+
+    df = df.copy()
+    for col in df.columns:
+        if col in TEXT_COLS and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype("category")
+    if "irrigation_count" in df.columns:
+        df["irrigation_count"] = df["irrigation_count"].astype("Int8")
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    return table.cast(_schema(df.columns))
+
+
+def write_parquet(df, path):
+    import pyarrow.parquet as pq
+    pq.write_table(to_table(df), path)
+
+
+def generate(crop, n_rows, path, seed=42, chunk_rows=1_000_000):
+    # vectorized generator written one row group per chunk
+    import pyarrow.parquet as pq
+    from fast_generator import draw_features, label_features, to_frame
+
+    rng = np.random.default_rng(seed)
+    writer = None
+    try:
+        for start in range(0, n_rows, chunk_rows):
+            features = draw_features(crop, min(chunk_rows, n_rows - start), rng)
+            table = to_table(to_frame(crop, features, label_features(crop, features)))
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _standardize(table, schema):
+    # rename the day column, add irrigation_count for rice, unify column order
+    import pyarrow as pa
+
+    names = ["days_since_start" if n in DAY_COLUMNS else n for n in table.column_names]
+    table = table.rename_columns(names)
+    if "irrigation_count" not in names:
+        table = table.append_column(
+            "irrigation_count", pa.nulls(len(table), type=pa.int8())
+        )
+    return table.select(FINAL_COLS).cast(schema)
+
+
+def merge(paths, out_path, batch_rows=500_000):
+    # streaming append, never more than one batch in memory
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _schema(FINAL_COLS)
+    with pq.ParquetWriter(out_path, schema) as writer:
+        for path in paths:
+            for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_rows):
+                writer.write_table(_standardize(pa.Table.from_batches([batch]), schema))
+
+
+def read_dataset(path, categorical=False):
+    # DataFrame for either format, parquet comes back with category columns
+    # categorical=True parses csv text columns straight into categories too
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    if categorical:
+        return pd.read_csv(path, dtype={col: "category" for col in TEXT_COLS})
+    return pd.read_csv(path)
+
+
+def report(csv_path="final_dataset.csv", parquet_path="final_dataset.parquet"):
+    print(f"{'format':<10}{'size MB':>10}{'parse s':>10}{'memory MB':>12}")
+    for path in [csv_path, parquet_path]:
+        if not os.path.exists(path):
+            continue
+        start = time.perf_counter()
+        df = read_dataset(path)
+        parse = time.perf_counter() - start
+        size = os.path.getsize(path) / 1024 ** 2
+        memory = df.memory_usage(deep=True).sum() / 1024 ** 2
+        name = "parquet" if path.endswith(".parquet") else "csv"
+        print(f"{name:<10}{size:>10.2f}{parse:>10.3f}{memory:>12.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Columnar dataset pipeline")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    gen = sub.add_parser("generate")
+    gen.add_argument("n_rows", type=int, help="rows per crop")
+    gen.add_argument("--seed", type=int, default=42)
+
+    sub.add_parser("merge")
+
+    rep = sub.add_parser("report")
+    rep.add_argument("--csv", default="final_dataset.csv")
+    rep.add_argument("--parquet", default="final_dataset.parquet")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        generate("wheat", args.n_rows, "wheat_fertilizer_dataset.parquet", seed=args.seed)
+        generate("rice", args.n_rows, "rice_fertilizer_dataset.parquet", seed=args.seed + 1)
+        print("wheat/rice parquet datasets generated")
+    elif args.command == "merge":
+        merge(
+            ["wheat_fertilizer_dataset.parquet", "rice_fertilizer_dataset.parquet"],
+            "final_dataset.parquet"
+        )
+        print("final_dataset.parquet written")
+    else:
+        report(args.csv, args.parquet)
@@ -0,0 +1,107 @@
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import train_test_split
+
+from train_model import load_dataset, encode_dataset, fit_model, export_flat, target_cols, weight_col
+
+'''
+Deduplicated, weighted training set.
+Sits between merging_data.py and train_model.py: identical feature/label rows
+are collapsed into one row with a weight column (the row count), and
+train_model.py fits the forest with sample_weight.
+
+The labels do not depend on area_acres, and days_since_start only matters
+through growth_stage, so before collapsing:
+    area_acres         is set to one constant
+    days_since_start   is snapped to the first or last day seen in its
+                       (crop, growth_stage), whichever is nearer, so any
+                       split on days still falls between two stages
+
+    python dedup_dataset.py                     final_dataset_dedup.csv
+    python dedup_dataset.py --compare           training time and accuracy, full vs dedup
+'''
+
+AREA_CONSTANT = 1.0
+
+
+def canonicalize(df):
+    df = df.copy()
+    df["area_acres"] = AREA_CONSTANT
+
+    days = df["days_since_start"]
+    group = df.groupby(["crop", "growth_stage"], observed=True)["days_since_start"]
+    first = group.transform("min")
+    last = group.transform("max")
+    df["days_since_start"] = np.where(days - first <= last - days, first, last).astype(days.dtype)
+    return df
+
+
+def dedup(df, weights=None):
+    # unique rows with the number of rows (or summed weight) they stand for
+    df = canonicalize(df)
+    df[weight_col] = 1 if weights is None else np.asarray(weights)
+    columns = [c for c in df.columns if c != weight_col]
+    return df.groupby(columns, sort=False, dropna=False, observed=True)[weight_col].sum().reset_index()
+
+
+def compare(path="final_dataset.csv", n_estimators=200, max_depth=12):
+    # same split for both: full rows vs dedup of the training rows, scored on the full test rows
+    df = load_dataset(path)
+    X, y, label_encoders, _ = encode_dataset(df)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+
+    train_rows = pd.concat([X_train, y_train], axis=1)
+    unique = dedup(train_rows)
+    weights = unique.pop(weight_col).to_numpy()
+
+    results = {}
+    runs = [
+        ("full", X_train, y_train, None),
+        ("dedup", unique[X.columns], unique[target_cols], weights)
+    ]
+    for name, X_fit, y_fit, sample_weight in runs:
+        start = time.perf_counter()
+        model = fit_model(
+            X_fit, y_fit, label_encoders,
+            n_estimators=n_estimators, max_depth=max_depth,
+            sample_weight=sample_weight
+        )
+        fit_s = time.perf_counter() - start
+        y_pred = export_flat(model, label_encoders, X.columns).predict(X_test.to_numpy())
+        results[name] = {
+            "rows": len(X_fit),
+            "fit_s": fit_s,
+            **{f"acc_{col}": a for col, a in zip(target_cols, (y_pred == y_test.to_numpy()).mean(axis=0))}
+        }
+
+    print(f"compression: {len(X_train)} -> {len(unique)} rows "
+          f"({len(X_train) / len(unique):.2f}x)")
+    print(pd.DataFrame(results).T.to_string(float_format="%.4f"))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collapse duplicate training rows into weights")
+    parser.add_argument("--data", default="final_dataset.csv")
+    parser.add_argument("--output", default="final_dataset_dedup.csv")
+    parser.add_argument("--compare", action="store_true",
+                        help="train on full and deduplicated rows and compare")
+    parser.add_argument("--n-estimators", type=int, default=200)
+    parser.add_argument("--max-depth", type=int, default=12)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.data, args.n_estimators, args.max_depth)
+    else:
+        df = load_dataset(args.data)
+        unique = dedup(df)
+        if args.output.endswith(".parquet"):
+            from columnar import write_parquet
+            write_parquet(unique, args.output)
+        else:
+            unique.to_csv(args.output, index=False)
+        print(f"{len(df)} rows -> {len(unique)} unique rows ({len(df) / len(unique):.2f}x), "
+              f"written to {args.output}")
@@ -0,0 +1,297 @@
+import os
+import re
+import json
+import time
+import hashlib
+import argparse
+
+'''
+Fertilizer doses from the Package of Practices PDF (pp_kharif.pdf).
+Builds the FERTILIZER_RANGES structure of recommendation.py from two
+tables of the book:
+    soil test table   "Fertilizer recommendations (kg per acre) ... Soil test
+                      category": urea by soil N category, SSP/DAP by soil P
+                      category, one row per crop
+    variety table     "Nutrients (kg per acre) N P2O5 K2O" of a crop chapter,
+                      one row per variety
+Requirement levels are the inverse of the soil test category (low soil N
+-> high N requirement). Doses are nutrient kg per acre: N, P as P2O5 and
+K as K2O. N is the variety range scaled by the soil category urea dose, P
+is the SSP and DAP dose of the category ("-" in the book: no phosphate on
+that soil, 0 kg), K is the variety K2O for deficient soils (medium) and
+none otherwise.
+
+Text extraction is the slow part (~5 s for the whole book), so it is done
+once per page: the cache (dose_tables.cache.json) keeps a small index of
+every page keyed by the hash of its content stream, and the parsed tables
+of the few pages that hold one. A rerun on the same PDFs only hashes the
+files; after an update only new or changed pages are extracted.
+
+pp_kharif.pdf is the kharif book, so it has rice but no wheat; wheat is in
+the rabi book. Crops found in several books are taken from the first one,
+crops not found keep the ranges typed in recommendation.py. The ranges are
+only written when they pass recommendation.range_errors (the typed levels,
+in order), and the app only uses them when started with
+FERT_RANGES=fertilizer_ranges.json.
+
+    python dose_tables.py                       writes fertilizer_ranges.json (rice)
+    python dose_tables.py --pdf pp_kharif.pdf pp_rabi.pdf
+    python dose_tables.py --check               print the ranges only
+'''
+
+CACHE_FORMAT = 2
+
+CROPS = ["rice", "wheat"]
+
+#P2O5 share of the phosphate fertilizers in the soil test table
+SSP_P2O5 = 0.16
+DAP_P2O5 = 0.46
+
+#soil test category -> requirement level
+REQUIREMENT = {"low": "high", "medium": "medium", "high": "low"}
+
+NUMBER = re.compile(r"^\d+(?:\.\d+)?$")
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def page_hash(page):
+    # hash of the decompressed content stream, same drawing -> same text
+    contents = page.get_contents()
+    return hashlib.sha1(contents.get_data() if contents is not None else b"").hexdigest()
+
+
+def _heading(lines):
+    # last upper case title in the first lines of a page ("2. COTTON", "RICE"), or None
+    titles = [
+        line.strip() for line in lines[:4]
+        if re.match(r"^(\d+\.\s*)?[A-Z][A-Z ,&()-]{2,}$", line.strip())
+    ]
+    return titles[-1] if titles else None
+
+
+def index_page(text):
+    # what the page holds, kept in the cache for every page
+    kinds = []
+    if "Fertilizer recommendations (kg per acre)" in text and "Soil test category" in text:
+        kinds.append("soil_test")
+    # the table header has to start a line, as parse_varieties looks for it
+    if (re.search(r"Nutrients\s*\n?\(kg per acre\)", text)
+            and re.search(r"^\s*N P2O5 K2O", text, re.M)):
+        kinds.append("variety")
+    return {"heading": _heading(text.splitlines()), "kinds": kinds}
+
+
+def _split_row(line):
+    # (name, trailing numbers or "--") of a table line
+    tokens = line.split()
+    values = []
+    while tokens and (NUMBER.match(tokens[-1]) or tokens[-1] in ("-", "--")):
+        values.insert(0, tokens.pop())
+    return " ".join(tokens), values
+
+
+def _number(token):
+    return None if token in ("-", "--") else float(token)
+
+
+def parse_soil_test(text):
+    # {crop: {"urea": [low, medium, high], "ssp": [...4], "dap": [...4]}}
+    rows = {}
+    for line in text.splitlines():
+        name, values = _split_row(line)
+        crop = name.strip().lower()
+        if crop in CROPS and len(values) == 11:
+            values = [_number(v) for v in values]
+            rows[crop] = {"urea": values[:3], "ssp": values[3::2], "dap": values[4::2]}
+    return rows
+
+
+def parse_varieties(text):
+    # [{"variety", "N", "P2O5", "K2O"}] of the first variety table on the page
+    lines = text.splitlines()
+    header = (i for i, line in enumerate(lines) if line.strip().startswith("N P2O5 K2O"))
+    start = next(header, None)
+    if start is None:
+        return []
+    rows, name = [], []
+    for line in lines[start + 1:]:
+        if line.strip().startswith(("*", "Note")):
+            break
+        prefix, values = _split_row(line)
+        if len(values) < 3:
+            name.append(line.strip())
+            continue
+        rows.append((" ".join(name + [prefix]).strip(), values))
+        name = []
+
+    if not rows:
+        return []
+
+    # variety names can end in a number (PR 132), the table width is the shortest row
+    width = min(len(values) for _, values in rows)
+    out = []
+    for name, values in rows:
+        name = " ".join([name] + values[:len(values) - width]).strip()
+        n, p, k = (_number(v) or 0.0 for v in values[len(values) - width:][:3])
+        out.append({"variety": name, "N": n, "P2O5": p, "K2O": k})
+    return out
+
+
+def to_ranges(soil_test, varieties):
+    # FERTILIZER_RANGES entry of one crop
+    urea = dict(zip(["low", "medium", "high"], soil_test["urea"]))
+    n = [v["N"] for v in varieties]
+    k = [v["K2O"] for v in varieties]
+
+    ranges = {"N": {}, "P": {}, "K": {}}
+    for category, level in REQUIREMENT.items():
+        scale = urea[category] / urea["medium"]
+        ranges["N"][level] = (round(min(n) * scale, 1), round(max(n) * scale, 1))
+
+        i = ["low", "medium", "high"].index(category)
+        # "-" for both fertilizers: the book applies no phosphate on this soil
+        p = [
+            dose * share
+            for dose, share in [(soil_test["ssp"][i], SSP_P2O5), (soil_test["dap"][i], DAP_P2O5)]
+            if dose
+        ] or [0.0]
+        ranges["P"][level] = (round(min(p), 1), round(max(p), 1))
+
+    # potassium only on deficient soils
+    ranges["K"] = {"low": (0.0, 0.0), "medium": (round(min(k), 1), round(max(k), 1))}
+    return ranges
+
+
+def _load_cache(path):
+    if not os.path.exists(path):
+        return {"format": CACHE_FORMAT, "books": {}, "pages": {}}
+    with open(path) as f:
+        cache = json.load(f)
+    return cache if cache.get("format") == CACHE_FORMAT else {"format": CACHE_FORMAT, "books": {}, "pages": {}}
+
+
+def _save_cache(cache, path):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(cache, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def extract_book(pdf, pages):
+    # (ranges per crop found, page keys, pages extracted); pages is the page cache,
+    # new pages are added to it
+    from pypdf import PdfReader
+
+    reader = PdfReader(pdf)
+    keys = []
+    extracted = 0
+    crop = None
+    soil_test, varieties = {}, {}
+    for page in reader.pages:
+        key = page_hash(page)
+        entry = pages.get(key)
+        if entry is None:
+            text = page.extract_text() or ""
+            extracted += 1
+            entry = index_page(text)
+            # tables are parsed only on the pages that have one
+            if "soil_test" in entry["kinds"]:
+                entry["soil_test"] = parse_soil_test(text)
+            if "variety" in entry["kinds"]:
+                entry["varieties"] = parse_varieties(text)
+            pages[key] = entry
+        keys.append(key)
+
+        # crop chapter the page belongs to, any other heading ends it
+        if entry["heading"]:
+            crop = entry["heading"].lower() if entry["heading"].lower() in CROPS else None
+        soil_test.update(entry.get("soil_test", {}))
+        if crop and entry.get("varieties") and crop not in varieties:
+            varieties[crop] = entry["varieties"]
+
+    ranges = {
+        crop: to_ranges(soil_test[crop], varieties[crop])
+        for crop in CROPS if crop in soil_test and crop in varieties
+    }
+    return ranges, keys, extracted
+
+
+def extract(pdfs=("pp_kharif.pdf",), cache_path="dose_tables.cache.json"):
+    # (ranges per crop found, stats per book), from the cache for books that did not change
+    cache = _load_cache(cache_path)
+    books = {}
+    ranges = {}
+    stats = []
+    for pdf in pdfs:
+        digest = file_hash(pdf)
+        book = cache["books"].get(digest)
+        if book is None:
+            book_ranges, keys, extracted = extract_book(pdf, cache["pages"])
+            book = {"ranges": book_ranges, "pages": keys}
+            stats.append({"pdf": pdf, "cached": False, "pages": len(keys), "extracted": extracted})
+        else:
+            stats.append({"pdf": pdf, "cached": True, "pages": len(book["pages"]), "extracted": 0})
+        books[digest] = book
+        for crop, crop_ranges in book["ranges"].items():
+            ranges.setdefault(crop, crop_ranges)
+
+    # books not asked for and their pages are dropped, the cache stays the size of these books
+    used = {key for book in books.values() for key in book["pages"]}
+    pages = {key: entry for key, entry in cache["pages"].items() if key in used}
+    _save_cache({"format": CACHE_FORMAT, "books": books, "pages": pages}, cache_path)
+    return ranges, stats
+
+
+def write_ranges(ranges, path="fertilizer_ranges.json"):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(ranges, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+if __name__ == "__main__":
+    from recommendation import RANGES_ENV, range_errors
+
+    parser = argparse.ArgumentParser(description="Fertilizer doses from the Package of Practices")
+    parser.add_argument("--pdf", nargs="+", default=["pp_kharif.pdf"],
+                        help="books to read, a crop is taken from the first book that has it")
+    parser.add_argument("--cache", default="dose_tables.cache.json")
+    parser.add_argument("--output", default="fertilizer_ranges.json",
+                        help=f"ranges file, used by recommendation.py with {RANGES_ENV}=<file>")
+    parser.add_argument("--check", action="store_true", help="print the ranges, write nothing")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    ranges, stats = extract(args.pdf, args.cache)
+    elapsed = time.perf_counter() - start
+    for book in stats:
+        if book["cached"]:
+            print(f"{book['pdf']} unchanged, ranges from {args.cache}")
+        else:
+            print(f"{book['pdf']}: {book['extracted']} of {book['pages']} pages extracted")
+    print(f"done in {elapsed:.2f} s")
+
+    for crop in CROPS:
+        if crop not in ranges:
+            print(f"{crop}: no dose tables in {', '.join(args.pdf)}, typed ranges kept")
+            continue
+        for nutrient, levels in ranges[crop].items():
+            text = ", ".join(f"{level} {low:g}-{high:g}" for level, (low, high) in levels.items())
+            print(f"{crop} {nutrient}: {text} kg/acre")
+
+    errors = range_errors(ranges)
+    for error in errors:
+        print(f"not usable: {error}")
+    if args.check:
+        parser.exit(0)
+    if errors:
+        parser.exit(1, f"{args.output} not written, recommendation.py keeps its typed ranges\n")
+    write_ranges(ranges, args.output)
+    print(f"{args.output} written, use it with {RANGES_ENV}={args.output}")
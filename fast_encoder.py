@@ -0,0 +1,155 @@
+import numpy as np
+import pandas as pd
+
+'''
+Compiled feature/target encoder.
+Built once from the LabelEncoders made in train_model.py and saved as
+compiled_encoder.joblib next to model.joblib. Lookup tables are made at
+build time, so encoding does not redo the np.unique/searchsorted work of
+LabelEncoder.transform on every call, and all three targets decode at once.
+'''
+
+#up to this many rows plain dict lookups beat pandas hashing
+SMALL_BATCH = 32
+
+
+class CompiledEncoder:
+
+    def __init__(self, columns, feature_classes, target_classes):
+        # columns: model feature order, feature_classes: {column: classes}
+        self.columns = list(columns)
+        self.feature_classes = {col: np.asarray(c) for col, c in feature_classes.items()}
+        self.target_cols = list(target_classes)
+        self.target_classes = {col: np.asarray(c) for col, c in target_classes.items()}
+        self._build()
+
+    def _build(self):
+        # lookup tables, rebuilt after unpickling instead of being stored
+        self._dicts = {
+            col: {str(v): i for i, v in enumerate(classes)}
+            for col, classes in self.feature_classes.items()
+        }
+        self._indexes = {
+            col: pd.Index(classes.astype(str))
+            for col, classes in self.feature_classes.items()
+        }
+
+        # one row per target, padded so a single fancy index decodes all three
+        width = max(len(c) for c in self.target_classes.values())
+        self._target_table = np.full((len(self.target_cols), width), None, dtype=object)
+        for i, col in enumerate(self.target_cols):
+            classes = self.target_classes[col]
+            self._target_table[i, :len(classes)] = classes
+
+    def __getstate__(self):
+        return {
+            "columns": self.columns,
+            "feature_classes": self.feature_classes,
+            "target_classes": self.target_classes
+        }
+
+    def __setstate__(self, state):
+        self.__init__(state["columns"], state["feature_classes"], state["target_classes"])
+
+    @classmethod
+    def from_label_encoders(cls, columns, feature_encoders, target_encoders):
+        return cls(
+            columns,
+            {col: enc.classes_ for col, enc in feature_encoders.items()},
+            {col: enc.classes_ for col, enc in target_encoders.items()}
+        )
+
+    def _codes(self, col, values):
+        if len(values) <= SMALL_BATCH:
+            lookup = self._dicts[col]
+            codes = np.array([lookup.get(str(v), -1) for v in values], dtype=np.int64)
+        else:
+            if values.dtype != object:
+                values = values.astype(str).astype(object)
+            codes = self._indexes[col].get_indexer(values)
+
+        if (codes < 0).any():
+            unknown = sorted(set(str(v) for v in np.asarray(values)[codes < 0]))
+            raise ValueError(
+                f"Unknown values for {col}: {', '.join(unknown)} "
+                f"(expected one of {', '.join(self._dicts[col])})"
+            )
+        return codes
+
+    def transform_array(self, df):
+        # float matrix in model column order
+        X = np.empty((len(df), len(self.columns)), dtype=np.float64)
+        for j, col in enumerate(self.columns):
+            values = df[col].to_numpy()
+            if col in self._dicts:
+                X[:, j] = self._codes(col, values)
+            else:
+                X[:, j] = values
+        return X
+
+    def transform(self, df):
+        # DataFrame so sklearn sees the feature names it was fitted with
+        return pd.DataFrame(self.transform_array(df), columns=self.columns, index=df.index)
+
+    def decode_array(self, prediction):
+        prediction = np.asarray(prediction, dtype=np.int64)
+        return self._target_table[np.arange(len(self.target_cols)), prediction]
+
+    def decode(self, prediction, index=None):
+        return pd.DataFrame(self.decode_array(prediction), columns=self.target_cols, index=index)
+
+
+def loop_encode(df, feature_encoders):
+    # the per-column LabelEncoder loop used before
+    df = df.copy()
+    for col, encoder in feature_encoders.items():
+        df[col] = encoder.transform(df[col].astype(str))
+    return df
+
+
+def loop_decode(prediction, target_encoders):
+    return pd.DataFrame({
+        col: target_encoders[col].inverse_transform(prediction[:, i])
+        for i, col in enumerate(target_encoders)
+    })
+
+
+if __name__ == "__main__":
+    import time
+    import joblib
+    from recommendation import build_features, TARGET_COLS
+
+    feature_encoders = joblib.load("feature_encoders.joblib")
+    target_encoders = joblib.load("target_encoders.joblib")
+    encoder = joblib.load("compiled_encoder.joblib")
+
+    data = pd.read_csv("final_dataset.csv")
+    prediction = np.column_stack([
+        target_encoders[col].transform(data[col]) for col in TARGET_COLS
+    ])
+
+    def bench(func, repeat):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        return (time.perf_counter() - start) / repeat
+
+    for n_rows, repeat in [(1, 2000), (100_000, 5)]:
+        idx = np.arange(n_rows) % len(data)
+        df = build_features(data.iloc[idx].reset_index(drop=True))
+        pred = prediction[idx]
+
+        assert (loop_encode(df, feature_encoders).to_numpy(dtype=float)
+                == encoder.transform_array(df)).all()
+        assert (loop_decode(pred, target_encoders).to_numpy()
+                == encoder.decode_array(pred)).all()
+
+        old = bench(lambda: loop_encode(df, feature_encoders), repeat)
+        new = bench(lambda: encoder.transform(df), repeat)
+        print(f"encode {n_rows:>7} rows: loop {old * 1e3:8.3f} ms, "
+              f"compiled {new * 1e3:8.3f} ms ({old / new:.1f}x)")
+
+        old = bench(lambda: loop_decode(pred, target_encoders), repeat)
+        new = bench(lambda: encoder.decode_array(pred), repeat)
+        print(f"decode {n_rows:>7} rows: loop {old * 1e3:8.3f} ms, "
+              f"compiled {new * 1e3:8.3f} ms ({old / new:.1f}x)")
@@ -0,0 +1,220 @@
+import time
+import numpy as np
+import pandas as pd
+
+'''
+Vectorized dataset generator shared by wheat and rice.
+Every feature is drawn as an integer code array and the labels are made
+with the same rules as coding_wheat.py / rice_dataset_making.py, but as
+clipped array arithmetic instead of one python call per row.
+'''
+
+#category tables, the position in the array is the integer code
+LEVELS = np.array(["low", "medium", "high"])
+STAGES = np.array(["early", "mid", "late"])
+SOILS = np.array(["sandy", "loamy", "clay"])
+PREV_LEVELS = np.array(["none", "low", "medium", "high"])
+FERT_TIMES = np.array(["<15", "15-30", ">30"])
+IRR_TIMES = np.array(["<7", "7-20", ">20"])
+IRR_LEVELS = np.array(["light", "normal", "heavy"])
+
+#stage base table, rows are early/mid/late and columns are N/P/K
+STAGE_BASE = {
+    "wheat": np.array([[2, 1, 0], [2, 0, 0], [0, 0, 0]], dtype=np.int8),
+    "rice": np.array([[2, 1, 0], [1, 0, 0], [0, 0, 0]], dtype=np.int8)
+}
+
+#last day of early and mid stage
+STAGE_CUTOFFS = {
+    "wheat": np.array([25, 60]),
+    "rice": np.array([20, 50])
+}
+
+#name of the day column in the generated csv
+DAY_COLUMN = {
+    "wheat": "days_since_sowing",
+    "rice": "days_since_transplanting"
+}
+
+#level shift for every code of a feature
+SOIL_SHIFT = np.array([1, 0, -1], dtype=np.int8)
+PREV_SHIFT = np.array([1, 0, 0, -1], dtype=np.int8)
+FERT_TIME_SHIFT = np.array([-1, 0, 1], dtype=np.int8)
+
+
+def get_stage_codes(crop, days):
+    # days <= cutoff belongs to that stage, same as get_sowing_period/get_rice_stage
+    return np.searchsorted(STAGE_CUTOFFS[crop], days, side="left").astype(np.int8)
+
+
+def _shift(level, shift):
+    level += shift
+    np.clip(level, 0, 2, out=level)
+    return level
+
+
+def apply_rules(crop, stage, soil, prev_n, prev_p, prev_k,
+                fert_time, irr_time, irr_level, irr_count=None):
+    base = STAGE_BASE[crop][stage]
+    fert_shift = FERT_TIME_SHIFT[fert_time]
+
+    # Nitrogen
+    n = _shift(base[:, 0].copy(), PREV_SHIFT[prev_n])
+    n = _shift(n, SOIL_SHIFT[soil])
+    if crop == "wheat":
+        n = _shift(n, (irr_count >= 2).astype(np.int8))
+    n = _shift(n, fert_shift)
+    # recent or heavy irrigation, capped to +1
+    n = _shift(n, ((irr_time == 0) | (irr_level == 2)).astype(np.int8))
+
+    # Phosphorus
+    p = _shift(base[:, 1].copy(), PREV_SHIFT[prev_p])
+    p = _shift(p, fert_shift)
+
+    # Potassium (never high)
+    k = _shift(base[:, 2].copy(), PREV_SHIFT[prev_k])
+    k = _shift(k, fert_shift)
+    np.minimum(k, 1, out=k)
+
+    return n, p, k
+
+
+def draw_features(crop, n_rows, rng):
+    features = {
+        "days": rng.integers(5, 121, n_rows, dtype=np.int16),
+        "soil": rng.integers(0, 3, n_rows, dtype=np.int8),
+        "prev_n": rng.integers(0, 4, n_rows, dtype=np.int8),
+        "prev_p": rng.integers(0, 4, n_rows, dtype=np.int8),
+        "prev_k": rng.integers(0, 4, n_rows, dtype=np.int8),
+        "fert_time": rng.integers(0, 3, n_rows, dtype=np.int8),
+        "irr_time": rng.integers(0, 3, n_rows, dtype=np.int8),
+        "irr_level": rng.integers(0, 3, n_rows, dtype=np.int8),
+        "area": np.round(rng.uniform(0.5, 5.0, n_rows), 2)
+    }
+    if crop == "wheat":
+        features["irr_count"] = rng.integers(0, 5, n_rows, dtype=np.int8)
+    features["stage"] = get_stage_codes(crop, features["days"])
+    return features
+
+
+def label_features(crop, features):
+    return apply_rules(
+        crop,
+        features["stage"],
+        features["soil"],
+        features["prev_n"],
+        features["prev_p"],
+        features["prev_k"],
+        features["fert_time"],
+        features["irr_time"],
+        features["irr_level"],
+        features.get("irr_count")
+    )
+
+
+def to_frame(crop, features, labels):
+    # categoricals write the same text to csv as the string columns
+    def cat(codes, table):
+        return pd.Categorical.from_codes(codes, categories=table)
+
+    n, p, k = labels
+    columns = {
+        "crop": cat(np.zeros(len(n), dtype=np.int8), np.array([crop])),
+        DAY_COLUMN[crop]: features["days"],
+        "growth_stage": cat(features["stage"], STAGES),
+        "soil_type": cat(features["soil"], SOILS),
+        "prev_N": cat(features["prev_n"], PREV_LEVELS),
+        "prev_P": cat(features["prev_p"], PREV_LEVELS),
+        "prev_K": cat(features["prev_k"], PREV_LEVELS),
+        "time_since_last_fertilizer": cat(features["fert_time"], FERT_TIMES)
+    }
+    if crop == "wheat":
+        columns["irrigation_count"] = features["irr_count"]
+    columns["time_since_last_irrigation"] = cat(features["irr_time"], IRR_TIMES)
+    columns["last_irrigation_level"] = cat(features["irr_level"], IRR_LEVELS)
+    columns["area_acres"] = features["area"]
+    columns["N_class"] = cat(n, LEVELS)
+    columns["P_class"] = cat(p, LEVELS)
+    columns["K_class"] = cat(k, LEVELS)
+    return pd.DataFrame(columns)
+
+
+def generate_dataset(crop, n_rows=3000, seed=None):
+    rng = np.random.default_rng(seed)
+    features = draw_features(crop, n_rows, rng)
+    return to_frame(crop, features, label_features(crop, features))
+
+
+# ---- checking against the original rule functions ----
+
+def legacy_labels(crop, df):
+    # runs the rule chain of generate_wheat_row / generate_rice_row on every row
+    if crop == "wheat":
+        import coding_wheat as rules
+        base = rules.sow_fertilizer_relation
+        get_stage = rules.get_sowing_period
+    else:
+        import rice_dataset_making as rules
+        base = rules.rice_stage_base
+        get_stage = rules.get_rice_stage
+
+    out = []
+    for row in df.astype(object).itertuples(index=False):
+        row = row._asdict()
+        stage = get_stage(row[DAY_COLUMN[crop]])
+        N = base[stage]["N"]
+        P = base[stage]["P"]
+        K = base[stage]["K"]
+
+        N = rules.prev_fertilizer_level_relation(N, row["prev_N"])
+        N = rules.soil_level_relation(N, row["soil_type"])
+        if crop == "wheat":
+            N = rules.prev_n_irrigations_level_relation(row["irrigation_count"], N)
+        N = rules.prev_fertilization_time_level_relation(N, row["time_since_last_fertilizer"])
+        N = rules.irrigation_recency_and_level_relation(
+            row["time_since_last_irrigation"], row["last_irrigation_level"], N
+        )
+
+        P = rules.prev_fertilizer_level_relation(P, row["prev_P"])
+        P = rules.prev_fertilization_time_level_relation(P, row["time_since_last_fertilizer"])
+
+        K = rules.prev_fertilizer_level_relation(K, row["prev_K"])
+        K = rules.prev_fertilization_time_level_relation(K, row["time_since_last_fertilizer"])
+        K = rules.potassium_safety(K)
+
+        out.append((stage, N, P, K))
+    return pd.DataFrame(out, columns=["growth_stage", "N_class", "P_class", "K_class"])
+
+
+def check_against_rules(crop, n_rows=100_000, seed=0):
+    df = generate_dataset(crop, n_rows, seed)
+    expected = legacy_labels(crop, df)
+    got = df[expected.columns].astype(str).reset_index(drop=True)
+    mismatches = int((got != expected).any(axis=1).sum())
+    return mismatches
+
+
+def rows_per_sec(func, n_rows):
+    start = time.perf_counter()
+    func(n_rows)
+    return n_rows / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    import coding_wheat
+    import rice_dataset_making
+
+    old_functions = {
+        "wheat": coding_wheat.generate_wheat_dataset,
+        "rice": rice_dataset_making.generate_rice_dataset
+    }
+
+    for crop in ["wheat", "rice"]:
+        mismatches = check_against_rules(crop)
+        print(f"{crop}: {mismatches} rows differ from the rule functions")
+
+        old_speed = rows_per_sec(old_functions[crop], 50_000)
+        new_speed = rows_per_sec(lambda n: generate_dataset(crop, n, seed=0), 5_000_000)
+        print(f"{crop}: old {old_speed:,.0f} rows/sec, "
+              f"vectorized {new_speed:,.0f} rows/sec "
+              f"({new_speed / old_speed:.0f}x)")
@@ -0,0 +1,269 @@
+import numpy as np
+
+'''
+Flat array version of the trained forests.
+All trees of all three targets are stored in contiguous node arrays and
+evaluated together with numpy, so one row needs a few array operations
+instead of 600 sklearn tree calls and joblib thread dispatch.
+
+Two layouts are supported:
+    MultiOutputClassifier(RandomForest)  value is (nodes, classes), one
+                                         group of trees per target
+    native multi-output RandomForest     value is (nodes, targets, classes),
+                                         every tree votes for all targets
+route_forests() joins per-crop forests into one by putting a split on the
+crop column in front of every tree.
+'''
+
+#rows scored at once, keeps the (rows, trees, classes) votes array small
+CHUNK_ROWS = 4096
+
+
+class FlatForest:
+
+    def __init__(self, feature, threshold, left, right, value, roots,
+                 target_starts, classes, max_depth):
+        self.feature = feature          # int32 per node, 0 for leaves
+        self.threshold = threshold      # float64 per node, inf for leaves
+        self.left = left                # int32 global node index, leaves point to themselves
+        self.right = right
+        self.value = value              # float64 leaf class fractions, see layouts above
+        self.roots = roots              # int32 root node of every tree
+        self.target_starts = target_starts  # first tree of every target
+        self.classes = classes          # int64 (targets, classes) vote column -> class label, -1 is padding
+        self.max_depth = int(max_depth)
+
+    @classmethod
+    def from_sklearn(cls, model, feature_index=None):
+        # model: MultiOutputClassifier of RandomForestClassifier (train_model.py)
+        # or a RandomForestClassifier fitted on all targets at once
+        # feature_index maps the model's columns to columns of the full feature matrix
+        native = getattr(model, "n_outputs_", 1) > 1
+        if native:
+            trees = [est.tree_ for est in model.estimators_]
+            target_starts = [0]
+            target_classes = list(model.classes_)
+            tree_targets = [None] * len(trees)
+        else:
+            trees = []
+            target_starts = []
+            tree_targets = []
+            for t, forest in enumerate(model.estimators_):
+                target_starts.append(len(trees))
+                trees.extend(est.tree_ for est in forest.estimators_)
+                tree_targets.extend([t] * len(forest.estimators_))
+            target_classes = [forest.classes_ for forest in model.estimators_]
+
+        n_classes = max(len(c) for c in target_classes)
+        classes = np.full((len(target_classes), n_classes), -1, dtype=np.int64)
+        for i, c in enumerate(target_classes):
+            classes[i, :len(c)] = c
+
+        sizes = np.array([t.node_count for t in trees])
+        offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        total = int(sizes.sum())
+
+        feature = np.zeros(total, dtype=np.int32)
+        threshold = np.full(total, np.inf)
+        left = np.arange(total, dtype=np.int32)
+        right = np.arange(total, dtype=np.int32)
+        if native:
+            value = np.zeros((total, len(target_classes), n_classes))
+        else:
+            value = np.zeros((total, n_classes))
+
+        for tree, target, start in zip(trees, tree_targets, offsets):
+            end = start + tree.node_count
+            split = tree.children_left >= 0
+            nodes = np.arange(start, end)[split]
+            used = tree.feature[split]
+            feature[nodes] = used if feature_index is None else np.asarray(feature_index)[used]
+            threshold[nodes] = tree.threshold[split]
+            left[nodes] = tree.children_left[split] + start
+            right[nodes] = tree.children_right[split] + start
+
+            # same normalization as DecisionTreeClassifier.predict_proba
+            outputs = enumerate(target_classes) if native else [(0, target_classes[target])]
+            for k, c in outputs:
+                proba = tree.value[:, k, :len(c)]
+                norm = proba.sum(axis=1, keepdims=True)
+                norm[norm == 0] = 1
+                if native:
+                    value[start:end, k, :len(c)] = proba / norm
+                else:
+                    value[start:end, :len(c)] = proba / norm
+
+        return cls(
+            feature, threshold, left, right, value,
+            offsets.astype(np.int32),
+            np.array(target_starts, dtype=np.int64),
+            classes,
+            max(t.max_depth for t in trees)
+        )
+
+    def apply(self, X):
+        # leaf node of every tree for every row, shape (rows, trees)
+        node = np.broadcast_to(self.roots, (len(X), len(self.roots))).copy()
+        rows = np.arange(len(X))[:, None]
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[node]] <= self.threshold[node]
+            node = np.where(go_left, self.left[node], self.right[node])
+        return node
+
+    def predict(self, X):
+        # sklearn compares float32 features with float64 thresholds
+        X = np.asarray(X, dtype=np.float32)
+        out = np.empty((len(X), len(self.classes)), dtype=np.int64)
+        targets = np.arange(len(self.classes))
+        for start in range(0, len(X), CHUNK_ROWS):
+            leaves = self.apply(X[start:start + CHUNK_ROWS])
+            if self.value.ndim == 3:
+                votes = self.value[leaves].sum(axis=1)
+            else:
+                votes = np.add.reduceat(self.value[leaves], self.target_starts, axis=1)
+            out[start:start + CHUNK_ROWS] = self.classes[targets, votes.argmax(axis=2)]
+        return out
+
+    def to_arrays(self):
+        return {
+            "feature": self.feature,
+            "threshold": self.threshold,
+            "left": self.left,
+            "right": self.right,
+            "value": self.value,
+            "roots": self.roots,
+            "target_starts": self.target_starts,
+            "classes": self.classes,
+            "max_depth": np.array(self.max_depth)
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(**{name: arrays[name] for name in [
+            "feature", "threshold", "left", "right", "value",
+            "roots", "target_starts", "classes", "max_depth"
+        ]})
+
+
+def _node_targets(forest):
+    # target of every node, None for native forests where nodes serve all targets
+    if forest.value.ndim == 3:
+        return None
+    tree_target = np.zeros(len(forest.roots), dtype=np.int64)
+    for t, start in enumerate(forest.target_starts):
+        tree_target[start:] = t
+    ends = np.append(forest.roots[1:], len(forest.feature))
+    return np.repeat(tree_target, ends - forest.roots)
+
+
+def _align_classes(forest, common):
+    # value columns reordered to the shared class list of every target
+    width = max(len(c) for c in common)
+    node_target = _node_targets(forest)
+    if node_target is None:
+        value = np.zeros((len(forest.feature), len(common), width))
+    else:
+        value = np.zeros((len(forest.feature), width))
+
+    for t, classes in enumerate(common):
+        for j, label in enumerate(classes):
+            old = np.flatnonzero(forest.classes[t] == label)
+            if not len(old):
+                continue
+            if node_target is None:
+                value[:, t, j] = forest.value[:, t, old[0]]
+            else:
+                mask = node_target == t
+                value[mask, j] = forest.value[mask, old[0]]
+    return value
+
+
+def route_forests(column, forests):
+    # forests: {code of the routing column: FlatForest}, all with the same tree layout
+    codes = sorted(forests)
+    parts = [forests[c] for c in codes]
+    n_trees = len(parts[0].roots)
+    for f in parts:
+        if len(f.roots) != n_trees or not np.array_equal(f.target_starts, parts[0].target_starts):
+            raise ValueError("Routed forests need the same number of trees per target")
+        if f.value.ndim != parts[0].value.ndim:
+            raise ValueError("Cannot route between native and per-target forests")
+
+    n_targets = len(parts[0].classes)
+    common = [
+        sorted(set().union(*(f.classes[t][f.classes[t] >= 0].tolist() for f in parts)))
+        for t in range(n_targets)
+    ]
+    classes = np.full((n_targets, max(len(c) for c in common)), -1, dtype=np.int64)
+    for t, c in enumerate(common):
+        classes[t, :len(c)] = c
+
+    # every tree starts with a chain of len(codes) - 1 routing nodes
+    n_router = n_trees * (len(codes) - 1)
+    offsets = np.cumsum([n_router] + [len(f.feature) for f in parts])[:-1]
+    router = np.arange(n_router, dtype=np.int32).reshape(len(codes) - 1, n_trees)
+
+    feature = [np.full(n_router, column, dtype=np.int32)]
+    threshold = [np.repeat([(a + b) / 2 for a, b in zip(codes, codes[1:])], n_trees)]
+    left = [np.concatenate([parts[k].roots + offsets[k] for k in range(len(codes) - 1)])]
+    right = [np.concatenate(
+        [router[k + 1] for k in range(len(codes) - 2)] + [parts[-1].roots + offsets[-1]]
+    )]
+    value_shape = (n_router,) + _align_classes(parts[0], common).shape[1:]
+    value = [np.zeros(value_shape)]
+
+    for f, off in zip(parts, offsets):
+        feature.append(f.feature)
+        threshold.append(f.threshold)
+        left.append(f.left + off)
+        right.append(f.right + off)
+        value.append(_align_classes(f, common))
+
+    return FlatForest(
+        np.concatenate(feature).astype(np.int32),
+        np.concatenate(threshold),
+        np.concatenate(left).astype(np.int32),
+        np.concatenate(right).astype(np.int32),
+        np.concatenate(value),
+        router[0].copy(),
+        parts[0].target_starts.copy(),
+        classes,
+        max(f.max_depth for f in parts) + len(codes) - 1
+    )
+
+
+def save_flat_forest(forest, path):
+    np.savez(path, **forest.to_arrays())
+
+
+def load_flat_forest(path):
+    with np.load(path) as arrays:
+        return FlatForest.from_arrays(arrays)
+
+
+if __name__ == "__main__":
+    import time
+    import joblib
+    import pandas as pd
+    from recommendation import build_features
+
+    model = joblib.load("model.joblib")
+    encoder = joblib.load("compiled_encoder.joblib")
+
+    flat = FlatForest.from_sklearn(model)
+    save_flat_forest(flat, "flat_model.npz")
+    flat = load_flat_forest("flat_model.npz")
+    print(f"exported {len(flat.roots)} trees, {len(flat.feature)} nodes to flat_model.npz")
+
+    data = pd.read_csv("final_dataset.csv")
+    X = encoder.transform(build_features(data))
+    mismatches = int((model.predict(X) != flat.predict(X)).any(axis=1).sum())
+    print(f"{mismatches} of {len(X)} rows differ from sklearn")
+
+    one = X.iloc[:1]
+    for name, func, repeat in [("sklearn", model.predict, 20), ("flat", flat.predict, 2000)]:
+        func(one)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            func(one)
+        print(f"{name}: {(time.perf_counter() - start) / repeat * 1e3:.3f} ms per single row")
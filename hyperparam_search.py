@@ -0,0 +1,148 @@
+import os
+import time
+import json
+import argparse
+import tempfile
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import train_test_split
+from sklearn.metrics import f1_score
+
+from train_model import load_dataset, encode_dataset, build_model, target_cols
+from flat_forest import FlatForest
+
+'''
+Hyperparameter search for the forest, accuracy against inference cost.
+Every configuration is trained in a worker process; the encoded train/test
+arrays are written once as .npy files and memory-mapped read-only by all
+workers. For each configuration the per-target F1, the single row and batch
+latency of the flat forest (what the app runs) and the artifact size are
+recorded, and the Pareto front is printed.
+'''
+
+GRID = {
+    "n_estimators": [10, 25, 50, 100, 200],
+    "max_depth": [4, 6, 8, 12, None]
+}
+
+_data = {}
+
+
+def _init_worker(data_dir, columns):
+    for name in ["X_train", "y_train", "X_test", "y_test"]:
+        _data[name] = np.load(os.path.join(data_dir, name + ".npy"), mmap_mode="r")
+    _data["columns"] = columns
+
+
+def _timed(func, repeat):
+    func()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def evaluate(params):
+    columns = _data["columns"]
+    X_train = pd.DataFrame(_data["X_train"], columns=columns)
+    X_test = pd.DataFrame(_data["X_test"], columns=columns)
+
+    model = build_model(**params)
+    model.estimator.set_params(n_jobs=1)  # the pool already uses every core
+
+    start = time.perf_counter()
+    model.fit(X_train, _data["y_train"])
+    fit_s = time.perf_counter() - start
+
+    flat = FlatForest.from_sklearn(model)
+    X = np.asarray(X_test, dtype=np.float32)
+    y_pred = flat.predict(X)
+
+    result = dict(params)
+    for i, col in enumerate(target_cols):
+        result[f"f1_{col}"] = f1_score(_data["y_test"][:, i], y_pred[:, i], average="macro")
+    result["min_f1"] = min(result[f"f1_{col}"] for col in target_cols)
+    result["fit_s"] = fit_s
+    result["single_ms"] = _timed(lambda: flat.predict(X[:1]), 200) * 1e3
+    result["batch_ms"] = _timed(lambda: flat.predict(X), 3) * 1e3
+    result["batch_rows"] = len(X)
+    result["size_mb"] = sum(a.nbytes for a in flat.to_arrays().values()) / 1024 ** 2
+    return result
+
+
+def pareto_front(results):
+    # not beaten on every one of: higher min_f1, lower single_ms, lower size_mb
+    def dominates(a, b):
+        better_or_equal = (
+            a["min_f1"] >= b["min_f1"]
+            and a["single_ms"] <= b["single_ms"]
+            and a["size_mb"] <= b["size_mb"]
+        )
+        strictly = (
+            a["min_f1"] > b["min_f1"]
+            or a["single_ms"] < b["single_ms"]
+            or a["size_mb"] < b["size_mb"]
+        )
+        return better_or_equal and strictly
+
+    return [r for r in results if not any(dominates(o, r) for o in results if o is not r)]
+
+
+def search(path="final_dataset.csv", grid=GRID, workers=None):
+    df = load_dataset(path)
+    X, y, _, _ = encode_dataset(df)
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=0.2, random_state=42
+    )
+
+    configs = [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        arrays = {
+            "X_train": X_train.to_numpy(dtype=np.float32),
+            "y_train": y_train.to_numpy(dtype=np.int64),
+            "X_test": X_test.to_numpy(dtype=np.float32),
+            "y_test": y_test.to_numpy(dtype=np.int64)
+        }
+        for name, arr in arrays.items():
+            np.save(os.path.join(data_dir, name + ".npy"), arr)
+
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(data_dir, list(X.columns))
+        ) as pool:
+            return list(pool.map(evaluate, configs))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search forest size vs accuracy and latency")
+    parser.add_argument("--data", default="final_dataset.csv")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--min-f1", type=float, default=0.95,
+                        help="accuracy bar used to pick the cheapest model")
+    parser.add_argument("--output", default="search_results.json")
+    args = parser.parse_args()
+
+    results = search(args.data, workers=args.workers)
+    front = sorted(pareto_front(results), key=lambda r: r["single_ms"])
+
+    with open(args.output, "w") as f:
+        json.dump({"results": results, "pareto_front": front}, f, indent=2)
+
+    columns = ["n_estimators", "max_depth"] + [f"f1_{c}" for c in target_cols] + [
+        "single_ms", "batch_ms", "size_mb", "fit_s"
+    ]
+    print("Pareto front:")
+    print(pd.DataFrame(front)[columns].to_string(index=False, float_format="%.4f"))
+
+    good = [r for r in front if r["min_f1"] >= args.min_f1]
+    if good:
+        best = min(good, key=lambda r: (r["single_ms"], r["size_mb"]))
+        print(f"\ncheapest model with min F1 >= {args.min_f1}: "
+              f"n_estimators={best['n_estimators']}, max_depth={best['max_depth']}")
+    else:
+        print(f"\nno configuration reaches min F1 {args.min_f1}")
@@ -0,0 +1,269 @@
+import os
+import json
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+import joblib
+
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.multioutput import MultiOutputClassifier
+
+from request_log import closed_segments, read_segment, read_feedback, recover_segments
+from train_model import target_cols, merge_forests, save_artifacts
+
+'''
+Incremental retraining from served traffic.
+Reads only the request log segments (request_log.py) closed since the last
+run, labels them and appends new trees fitted on those rows to the saved
+forests, so a run costs time for the new rows only, not the whole history.
+The updated model.flat is picked up by running apps and services through
+the model store hot reload, which validates it before serving.
+
+Labels:
+    feedback   outcomes reported for a request (default), rows wait until
+               every target has one
+    rules      feedback where there is some, rule_predictor for the rest
+               (the training labels are rule generated too)
+
+The names of the request and feedback segments read so far are kept in
+retrain_state.json, so every segment is read once. Rows that are not
+labelled yet (or too few to hold every class) and feedback whose request
+was not read yet are kept in retrain_state.pending.npz and matched again
+on the next runs; the oldest are dropped beyond --max-pending.
+
+    python incremental_training.py requests/ --trees-per-update 10 --max-trees 400
+'''
+
+STATE_FILE = "retrain_state.json"
+
+
+def load_state(path=STATE_FILE):
+    if not os.path.exists(path):
+        return {"consumed": [], "feedback_consumed": [], "updates": []}
+    with open(path) as f:
+        state = json.load(f)
+    state.setdefault("feedback_consumed", [])
+    return state
+
+
+def save_state(state, path=STATE_FILE):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def pending_path(state_path=STATE_FILE):
+    return os.path.splitext(state_path)[0] + ".pending.npz"
+
+
+def load_pending(path, n_features, n_targets):
+    # rows waiting for labels (ids, X, y with -1 where unknown) and unmatched feedback
+    if not os.path.exists(path):
+        return {
+            "ids": np.empty(0, dtype=np.uint64),
+            "X": np.empty((0, n_features), dtype=np.float32),
+            "y": np.empty((0, n_targets), dtype=np.int8),
+            "feedback_ids": np.empty(0, dtype=np.uint64),
+            "feedback": np.empty((0, n_targets), dtype=np.int8)
+        }
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+
+def save_pending(pending, path):
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, **pending)
+    os.replace(tmp_path, path)
+
+
+def new_segments(log_dir, state, kind="requests"):
+    consumed = set(state["consumed" if kind == "requests" else "feedback_consumed"])
+    return [p for p in closed_segments(log_dir, kind) if os.path.basename(p) not in consumed]
+
+
+def read_requests(paths, columns):
+    # (ids, X) of all request records in paths
+    ids, X = [], []
+    for path in paths:
+        header, records = read_segment(path)
+        if header["columns"] != list(columns):
+            raise ValueError(f"{path} was logged with columns {header['columns']}, "
+                             f"the model uses {list(columns)}")
+        ids.append(records["id"])
+        X.append(records["features"])
+    if not ids:
+        return np.empty(0, dtype=np.uint64), np.empty((0, len(columns)), dtype=np.float32)
+    return np.concatenate(ids), np.concatenate(X)
+
+
+def decode_features(X, encoder):
+    # encoded rows back to a feature frame, for the rules
+    df = pd.DataFrame(X, columns=encoder.columns)
+    for col, classes in encoder.feature_classes.items():
+        df[col] = np.asarray(classes)[df[col].to_numpy().astype(int)]
+    return df
+
+
+def rule_codes(X, encoder):
+    from rule_predictor import predict_batch
+
+    labels = predict_batch(decode_features(X, encoder))
+    return np.column_stack([
+        pd.Index(encoder.target_classes[col]).get_indexer(labels[col].astype(str))
+        for col in target_cols
+    ])
+
+
+def match_feedback(ids, y, feedback_ids, feedback):
+    # fills y in place from the feedback (later wins per target), returns the
+    # mask of feedback records whose request is not in ids
+    row = {request_id: i for i, request_id in enumerate(ids.tolist())}
+    unmatched = np.ones(len(feedback_ids), dtype=bool)
+    for j, request_id in enumerate(feedback_ids.tolist()):
+        i = row.get(request_id)
+        if i is not None:
+            known = feedback[j] >= 0
+            y[i, known] = feedback[j, known]
+            unmatched[j] = False
+    return unmatched
+
+
+def label_rows(X, y, encoder, labels="feedback"):
+    # mask of the rows with a label for every target, rules fill y in place
+    if labels == "rules":
+        missing = (y < 0).any(axis=1)
+        if missing.any():
+            ruled = rule_codes(X[missing], encoder)
+            y[missing] = np.where(y[missing] < 0, ruled, y[missing])
+    return (y >= 0).all(axis=1)
+
+
+def update_model(model, X, y, columns, trees_per_update=10, max_depth=12, max_trees=None,
+                 seed=None):
+    # appends trees_per_update trees per target fitted on (X, y) only
+    if not isinstance(model, MultiOutputClassifier):
+        raise ValueError("Incremental updates need the default model layout "
+                         "(one forest per target, train_model.py without --native/--per-crop)")
+
+    X = pd.DataFrame(X, columns=columns)
+    for i, forest in enumerate(model.estimators_):
+        new = RandomForestClassifier(
+            n_estimators=trees_per_update,
+            max_depth=max_depth,
+            random_state=seed,
+            n_jobs=-1
+        )
+        # y has every class (has_all_classes), so the trees vote over forest.classes_
+        new.fit(X, y[:, i])
+        merge_forests([forest, new])
+        if max_trees and len(forest.estimators_) > max_trees:
+            # oldest trees go first
+            forest.estimators_ = forest.estimators_[-max_trees:]
+            forest.n_estimators = max_trees
+    return model
+
+
+def has_all_classes(y, encoder):
+    return all(
+        len(np.unique(y[:, i])) == len(encoder.target_classes[col])
+        for i, col in enumerate(target_cols)
+    )
+
+
+def _unique_last(ids):
+    # mask keeping the last row of every id (a segment read twice after a crash)
+    _, first = np.unique(ids[::-1], return_index=True)
+    keep = np.zeros(len(ids), dtype=bool)
+    keep[len(ids) - 1 - first] = True
+    return keep
+
+
+def retrain(log_dir, labels="feedback", trees_per_update=10, max_depth=12, max_trees=None,
+            state_path=STATE_FILE, max_pending=1_000_000):
+    # segments of a crashed server are closed first, their rows are not lost
+    recover_segments(log_dir)
+    state = load_state(state_path)
+    request_paths = new_segments(log_dir, state, "requests")
+    feedback_paths = new_segments(log_dir, state, "feedback")
+    if not request_paths and not feedback_paths:
+        print("no new log segments")
+        return None
+
+    start = time.perf_counter()
+    encoder = joblib.load("compiled_encoder.joblib")
+    n_targets = len(target_cols)
+    pending = load_pending(pending_path(state_path), len(encoder.columns), n_targets)
+
+    # pending rows first, then the new ones, all unlabelled until matched
+    new_ids, new_X = read_requests(request_paths, encoder.columns)
+    ids = np.concatenate([pending["ids"], new_ids])
+    X = np.concatenate([pending["X"], new_X])
+    y = np.concatenate([
+        pending["y"].astype(np.int64), np.full((len(new_ids), n_targets), -1, dtype=np.int64)
+    ])
+    keep = _unique_last(ids)
+    ids, X, y = ids[keep], X[keep], y[keep]
+
+    new_feedback_ids, new_feedback = read_feedback(feedback_paths)
+    feedback_ids = np.concatenate([pending["feedback_ids"], new_feedback_ids])
+    feedback = np.concatenate([pending["feedback"], new_feedback.reshape(-1, n_targets)])
+    unmatched = match_feedback(ids, y, feedback_ids, feedback)
+    labelled = label_rows(X, y, encoder, labels)
+
+    update = None
+    if labelled.any() and has_all_classes(y[labelled], encoder):
+        model = joblib.load("model.joblib")
+        label_encoders = joblib.load("feature_encoders.joblib")
+        target_encoders = joblib.load("target_encoders.joblib")
+        update_model(model, X[labelled], y[labelled], encoder.columns, trees_per_update,
+                     max_depth, max_trees, seed=len(state["updates"]))
+        save_artifacts(model, label_encoders, target_encoders, encoder.columns)
+        update = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "segments": len(request_paths) + len(feedback_paths),
+            "rows": int(labelled.sum()),
+            "trees": len(model.estimators_[0].estimators_),
+            "seconds": round(time.perf_counter() - start, 2)
+        }
+        state["updates"].append(update)
+        ids, X, y = ids[~labelled], X[~labelled], y[~labelled]
+
+    # everything read now lives in the pending file, the segments are not read again
+    save_pending({
+        "ids": ids[-max_pending:],
+        "X": X[-max_pending:],
+        "y": y[-max_pending:].astype(np.int8),
+        "feedback_ids": feedback_ids[unmatched][-max_pending:],
+        "feedback": feedback[unmatched][-max_pending:].astype(np.int8)
+    }, pending_path(state_path))
+    state["consumed"] += [os.path.basename(p) for p in request_paths]
+    state["feedback_consumed"] += [os.path.basename(p) for p in feedback_paths]
+    save_state(state, state_path)
+
+    waiting = f"{min(len(ids), max_pending)} rows waiting for labels"
+    if update is None:
+        print(f"{len(request_paths)} request and {len(feedback_paths)} feedback segments, "
+              f"{int(labelled.sum())} labelled rows: not every class seen yet, {waiting}")
+    else:
+        print(f"{update['rows']} labelled rows, {update['segments']} new log segments, "
+              f"{update['trees']} trees per target, {update['seconds']:.1f} s, {waiting}")
+    return update
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Update the model with logged requests")
+    parser.add_argument("log_dir", help="request log directory (--request-log / FERT_REQUEST_LOG)")
+    parser.add_argument("--labels", choices=["feedback", "rules"], default="feedback")
+    parser.add_argument("--trees-per-update", type=int, default=10)
+    parser.add_argument("--max-depth", type=int, default=12)
+    parser.add_argument("--max-trees", type=int, help="drop the oldest trees beyond this many")
+    parser.add_argument("--state", default=STATE_FILE)
+    parser.add_argument("--max-pending", type=int, default=1_000_000,
+                        help="unlabelled rows kept for later feedback, oldest dropped first")
+    args = parser.parse_args()
+
+    retrain(args.log_dir, args.labels, args.trees_per_update, args.max_depth, args.max_trees,
+            args.state, args.max_pending)
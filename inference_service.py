@@ -0,0 +1,322 @@
+import json
+import time
+import asyncio
+import argparse
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from model_store import ModelStore
+from recommendation import (
+    INPUT_COLS,
+    NUTRIENTS,
+    TARGET_COLS,
+    build_features,
+    predict_classes,
+    compute_fertilizer_quantity
+)
+
+'''
+Local HTTP JSON inference service.
+Requests that arrive within a short window are scored together with one
+batched model.predict call. Only the python standard library is used for
+the server so it runs on localhost without extra services.
+
+    POST /recommend   one field (json object) or a list of fields
+    GET  /metrics     throughput, latency percentiles, batch sizes
+    GET  /health
+    GET  /version     served model version, reload history
+    POST /reload      check model.flat for a new version now
+    POST /rollback    go back to the previous model version
+    POST /feedback    {"request_id": ..., "N_class": ..., ...} observed outcome
+                      (with --request-log, see request_log.py)
+
+Field keys are the model input columns: crop, days_since_start, soil_type,
+prev_N, prev_P, prev_K, time_since_last_fertilizer, irrigation_count (not
+needed for rice), time_since_last_irrigation, last_irrigation_level,
+area_acres.
+'''
+
+#irrigation_count is only needed for wheat
+REQUIRED_COLS = [c for c in INPUT_COLS if c != "irrigation_count"]
+
+
+class Metrics:
+
+    def __init__(self, window=10_000):
+        self.started = time.perf_counter()
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.batched_fields = 0
+        self.latencies = deque(maxlen=window)
+
+    def record(self, latency, ok=True):
+        self.requests += 1
+        if not ok:
+            self.errors += 1
+        self.latencies.append(latency)
+
+    def snapshot(self):
+        elapsed = time.perf_counter() - self.started
+        lat = np.array(self.latencies) * 1e3 if self.latencies else np.zeros(1)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "uptime_s": round(elapsed, 1),
+            "throughput_rps": round(self.requests / elapsed, 1),
+            "latency_ms": {
+                "p50": round(float(np.percentile(lat, 50)), 3),
+                "p99": round(float(np.percentile(lat, 99)), 3),
+                "max": round(float(lat.max()), 3)
+            },
+            "batches": self.batches,
+            "mean_batch_size": round(self.batched_fields / max(self.batches, 1), 2)
+        }
+
+
+class MicroBatcher:
+    # collects fields for window_ms (or max_batch) and scores them together
+
+    def __init__(self, store, window_ms=5.0, max_batch=256):
+        self.store = store
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.queue = asyncio.Queue()
+        self.metrics = Metrics()
+
+    async def submit(self, field):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((field, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            fields = [field for field, _ in batch]
+            try:
+                results = await loop.run_in_executor(None, self.score, fields)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.metrics.batches += 1
+            self.metrics.batched_fields += len(batch)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def score(self, fields):
+        # the whole batch is scored by one model version, even during a reload
+        current = self.store.current
+        try:
+            return self._score(current, fields)
+        except (ValueError, KeyError, TypeError):
+            pass
+        # one bad field should not fail the others, score them one by one
+        results = []
+        for field in fields:
+            try:
+                results.extend(self._score(current, [field]))
+            except (ValueError, KeyError, TypeError) as e:
+                results.append({"error": str(e)})
+        return results
+
+    def _score(self, current, fields):
+        df = pd.DataFrame(fields, columns=INPUT_COLS)
+        missing = [c for c in REQUIRED_COLS if df[c].isna().any()]
+        if missing:
+            raise ValueError(f"Missing fields: {', '.join(missing)}")
+
+        df = build_features(df)
+        classes = predict_classes(
+            df, current.forest, current.encoder, current.encoder, log=current.log
+        )
+
+        results = []
+        rows = zip(df["crop"], df["area_acres"], classes[TARGET_COLS].itertuples(index=False))
+        for crop, area, levels in rows:
+            result = {}
+            for nutrient, level in zip(NUTRIENTS, levels):
+                qty = compute_fertilizer_quantity(crop, nutrient, level, float(area))
+                result[nutrient] = {"requirement": level, **qty}
+            results.append(result)
+        if "request_id" in classes:
+            for result, request_id in zip(results, classes["request_id"]):
+                result["request_id"] = int(request_id)
+        return results
+
+
+# ---- minimal HTTP/1.1 server ----
+
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error"
+}
+
+
+async def read_request(reader):
+    line = await reader.readline()
+    if not line:
+        return None
+    method, path, _ = line.decode("latin-1").split(" ", 2)
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        key, _, value = line.decode("latin-1").partition(":")
+        headers[key.strip().lower()] = value.strip()
+
+    length = int(headers.get("content-length", 0))
+    body = await reader.readexactly(length) if length else b""
+    return method, path, headers, body
+
+
+def write_response(writer, status, payload, keep_alive):
+    body = json.dumps(payload).encode("utf-8")
+    writer.write(
+        f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+        f"Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1")
+        + body
+    )
+
+
+def feedback(store, method, body):
+    if method != "POST":
+        return 405, {"error": "use POST"}
+    if store.request_log is None:
+        return 404, {"error": "request log is off (--request-log)"}
+    try:
+        payload = json.loads(body)
+        items = payload if isinstance(payload, list) else [payload]
+        ids = [int(item["request_id"]) for item in items]
+        outcome = [store.request_log.outcome_codes(item) for item in items]
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        return 400, {"error": f"bad feedback: {e}"}
+    store.request_log.feedback(ids, outcome)
+    return 200, {"recorded": len(ids)}
+
+
+async def handle(batcher, method, path, body):
+    store = batcher.store
+    if path == "/health":
+        return 200, {"status": "ok", "model_version": store.version}
+    if path == "/metrics":
+        return 200, {**batcher.metrics.snapshot(), "model_version": store.version}
+    if path == "/version":
+        return 200, store.status()
+    if path in ("/reload", "/rollback"):
+        if method != "POST":
+            return 405, {"error": "use POST"}
+        loop = asyncio.get_running_loop()
+        try:
+            if path == "/reload":
+                swapped = await loop.run_in_executor(None, store.reload)
+                return 200, {"swapped": swapped, **store.status()}
+            await loop.run_in_executor(None, store.rollback)
+        except (ValueError, OSError) as e:
+            return 400, {"error": str(e)}
+        return 200, store.status()
+    if path == "/feedback":
+        return feedback(store, method, body)
+    if path != "/recommend":
+        return 404, {"error": "not found"}
+    if method != "POST":
+        return 405, {"error": "use POST"}
+
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return 400, {"error": "body must be json"}
+
+    fields = payload if isinstance(payload, list) else [payload]
+    if not fields or not all(isinstance(f, dict) for f in fields):
+        return 400, {"error": "expected a field object or a list of them"}
+
+    try:
+        results = await asyncio.gather(*(batcher.submit(f) for f in fields))
+    except Exception as e:
+        return 500, {"error": str(e)}
+    if any("error" in r for r in results) and not isinstance(payload, list):
+        return 400, results[0]
+    return 200, results if isinstance(payload, list) else results[0]
+
+
+async def serve_connection(batcher, reader, writer):
+    try:
+        while True:
+            request = await read_request(reader)
+            if request is None:
+                break
+            method, path, headers, body = request
+            keep_alive = headers.get("connection", "keep-alive").lower() != "close"
+
+            start = time.perf_counter()
+            status, payload = await handle(batcher, method, path.split("?")[0], body)
+            if path.startswith("/recommend"):
+                batcher.metrics.record(time.perf_counter() - start, ok=(status == 200))
+
+            write_response(writer, status, payload, keep_alive)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def main(host, port, artifact, window_ms, max_batch, poll_s, request_log):
+    store = ModelStore(artifact, poll_s=poll_s, log_dir=request_log).start()
+    batcher = MicroBatcher(store, window_ms=window_ms, max_batch=max_batch)
+    worker = asyncio.create_task(batcher.run())
+
+    server = await asyncio.start_server(
+        lambda r, w: serve_connection(batcher, r, w), host, port
+    )
+    print(f"serving model {store.version} on http://{host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        worker.cancel()
+        store.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fertilizer recommendation HTTP service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--artifact", default="model.flat")
+    parser.add_argument("--window-ms", type=float, default=5.0)
+    parser.add_argument("--max-batch", type=int, default=256)
+    parser.add_argument("--poll-s", type=float, default=10.0,
+                        help="how often to check the artifact for a new version")
+    parser.add_argument("--request-log", metavar="DIR",
+                        help="log every scored request here for retraining")
+    args = parser.parse_args()
+
+    asyncio.run(main(
+        args.host, args.port, args.artifact, args.window_ms, args.max_batch, args.poll_s,
+        args.request_log
+    ))
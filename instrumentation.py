@@ -0,0 +1,189 @@
+import os
+import sys
+import json
+import time
+import io
+import threading
+import cProfile
+import pstats
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+'''
+Per-stage timing for the recommendation pipeline.
+
+    with stage("predict"):
+        ...
+
+records the time of every stage into a histogram when timing is enabled
+(FERT_TIMING=1 or enable()). When it is disabled stage() returns a shared
+no-op context, so the cost is one function call.
+profile() wraps a single request in cProfile or a simple sampling profiler.
+'''
+
+#histogram buckets are powers of two in microseconds (1 µs .. ~67 s)
+N_BUCKETS = 27
+
+_enabled = os.environ.get("FERT_TIMING", "") not in ("", "0")
+_lock = threading.Lock()
+_stats = {}
+_NULL = nullcontext()
+
+
+class StageStats:
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+        self.buckets = [0] * N_BUCKETS
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        bucket = min(int(seconds * 1e6).bit_length(), N_BUCKETS - 1)
+        self.buckets[bucket] += 1
+
+    def percentile(self, q):
+        # upper edge of the bucket holding the q-th percentile, in seconds
+        target = q / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= target:
+                return min((1 << i) / 1e6, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "total_ms": self.total * 1e3,
+            "mean_ms": self.total / self.count * 1e3 if self.count else 0.0,
+            "min_ms": self.min * 1e3 if self.count else 0.0,
+            "max_ms": self.max * 1e3,
+            "p50_ms": self.percentile(50) * 1e3,
+            "p99_ms": self.percentile(99) * 1e3,
+            "buckets_us": {str(1 << i): n for i, n in enumerate(self.buckets) if n}
+        }
+
+
+def enable(on=True):
+    global _enabled
+    _enabled = on
+
+
+def enabled():
+    return _enabled
+
+
+def record(name, seconds):
+    with _lock:
+        stats = _stats.get(name)
+        if stats is None:
+            stats = _stats[name] = StageStats()
+        stats.add(seconds)
+
+
+@contextmanager
+def _timed(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def stage(name):
+    if not _enabled:
+        return _NULL
+    return _timed(name)
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+def snapshot():
+    with _lock:
+        return {name: stats.to_dict() for name, stats in _stats.items()}
+
+
+def summary():
+    lines = [f"{'stage':<16}{'count':>8}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+    for name, s in snapshot().items():
+        lines.append(
+            f"{name:<16}{s['count']:>8}{s['mean_ms']:>10.3f}"
+            f"{s['p50_ms']:>10.3f}{s['p99_ms']:>10.3f}{s['max_ms']:>10.3f}"
+        )
+    return "\n".join(lines)
+
+
+def export(path):
+    with open(path, "w") as f:
+        json.dump(snapshot(), f, indent=2)
+
+
+# ---- per request profiling ----
+
+class Sampler:
+    # samples the stack of the profiled thread every interval seconds
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.samples = Counter()
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def report(self, top=25):
+        # collapsed stacks, most sampled first (flamegraph input format)
+        return "\n".join(f"{stack} {n}" for stack, n in self.samples.most_common(top))
+
+
+@contextmanager
+def profile(kind="cprofile", result=None):
+    # result (a dict) gets the report text under "report"
+    if kind == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(25)
+            if result is not None:
+                result["report"] = out.getvalue()
+    elif kind == "sample":
+        sampler = Sampler()
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            if result is not None:
+                result["report"] = sampler.report()
+    else:
+        raise ValueError(f"Unknown profiler {kind!r}, use 'cprofile' or 'sample'")
@@ -20,11 +20,12 @@ def concat_datasets(wheat_file, rice_file):
     return final_df
 
 
-rice_wheat_dataset = concat_datasets(
-    "wheat_fertilizer_dataset.csv",
-    "rice_fertilizer_dataset.csv"
-)
+if __name__ == "__main__":
+    rice_wheat_dataset = concat_datasets(
+        "wheat_fertilizer_dataset.csv",
+        "rice_fertilizer_dataset.csv"
+    )
 
-print(rice_wheat_dataset.info())
+    print(rice_wheat_dataset.info())
 
-rice_wheat_dataset.to_csv("final_dataset.csv", index=False)
+    rice_wheat_dataset.to_csv("final_dataset.csv", index=False)
@@ -0,0 +1,286 @@
+import os
+import sys
+import json
+import mmap
+import time
+import hashlib
+import subprocess
+
+import numpy as np
+
+from flat_forest import FlatForest
+from fast_encoder import CompiledEncoder
+
+'''
+Memory-mappable model artifact (model.flat).
+
+Layout:
+    8 bytes   magic b"FLATRF01"
+    8 bytes   little endian header length
+    header    json: format, version, feature schema, array table
+    arrays    raw little endian arrays, each aligned to 64 bytes
+
+The arrays are read with np.frombuffer on a read-only mmap, so loading
+only parses the small header and every worker process on the host shares
+the same page cache pages instead of holding a private copy.
+'''
+
+MAGIC = b"FLATRF01"
+FORMAT_VERSION = 1
+ALIGN = 64
+
+ARRAY_NAMES = [
+    "feature", "threshold", "left", "right", "value",
+    "roots", "target_starts", "classes"
+]
+
+
+def _pad(n):
+    return (-n) % ALIGN
+
+
+def write_artifact(path, forest, encoder, version=None):
+    # version: write time and a hash of the content, two writes in the same second
+    # differ unless they are the same model
+    arrays = {}
+    table = {}
+    offset = 0
+    for name in ARRAY_NAMES:
+        arr = np.ascontiguousarray(getattr(forest, name))
+        arr = arr.astype(arr.dtype.newbyteorder("<"), copy=False)
+        arrays[name] = arr
+        table[name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset}
+        offset += arr.nbytes + _pad(arr.nbytes)
+
+    header = {
+        "format": FORMAT_VERSION,
+        "version": version,
+        "max_depth": forest.max_depth,
+        "columns": encoder.columns,
+        "feature_classes": {c: [str(v) for v in k] for c, k in encoder.feature_classes.items()},
+        "target_classes": {c: [str(v) for v in k] for c, k in encoder.target_classes.items()},
+        "arrays": table
+    }
+    if version is None:
+        digest = hashlib.sha1(json.dumps(header, sort_keys=True).encode("utf-8"))
+        for name in ARRAY_NAMES:
+            digest.update(memoryview(arrays[name]).cast("B"))
+        header["version"] = f"{time.strftime('%Y%m%d-%H%M%S')}-{digest.hexdigest()[:10]}"
+    raw = json.dumps(header).encode("utf-8")
+    raw += b" " * _pad(len(MAGIC) + 8 + len(raw))
+
+    # write next to the target and rename, readers never see half a file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(raw).to_bytes(8, "little"))
+        f.write(raw)
+        for name in ARRAY_NAMES:
+            f.write(arrays[name].tobytes())
+            f.write(b"\0" * _pad(arrays[name].nbytes))
+    keep_previous(path)
+    os.replace(tmp_path, path)
+    return header
+
+
+def keep_previous(path):
+    # the replaced version stays as path.prev for rollback, path never disappears
+    if os.path.exists(path):
+        link = path + ".prev.tmp"
+        if os.path.exists(link):
+            os.remove(link)
+        os.link(path, link)
+        os.replace(link, path + ".prev")
+
+
+def read_header(path):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a flat model artifact")
+        size = int.from_bytes(f.read(8), "little")
+        header = json.loads(f.read(size))
+    if header["format"] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported artifact format {header['format']} in {path}")
+    header["data_offset"] = len(MAGIC) + 8 + size
+    return header
+
+
+def read_artifact(path):
+    # returns (FlatForest, CompiledEncoder, header), arrays are read-only views of the file
+    header = read_header(path)
+    with open(path, "rb") as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    arrays = {}
+    for name, info in header["arrays"].items():
+        dtype = np.dtype(info["dtype"])
+        count = int(np.prod(info["shape"]))
+        arrays[name] = np.frombuffer(
+            buf, dtype=dtype, count=count,
+            offset=header["data_offset"] + info["offset"]
+        ).reshape(info["shape"])
+
+    forest = FlatForest(max_depth=header["max_depth"], **arrays)
+    encoder = CompiledEncoder(
+        header["columns"],
+        {c: np.array(v, dtype=object) for c, v in header["feature_classes"].items()},
+        {c: np.array(v, dtype=object) for c, v in header["target_classes"].items()}
+    )
+    return forest, encoder, header
+
+
+# ---- size / load time / memory report ----
+
+def _memory_kb():
+    # (VmRSS, RssAnon) in kB, RssAnon is the private part
+    values = {}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in ("VmRSS", "RssAnon"):
+                    values[key] = int(rest.split()[0])
+    except OSError:
+        import resource
+        values["VmRSS"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return values.get("VmRSS", 0), values.get("RssAnon", 0)
+
+
+_LOADERS = {
+    "joblib": "import joblib; obj = joblib.load(path)",
+    "npz": "from flat_forest import load_flat_forest; obj = load_flat_forest(path)",
+    "flat": "from model_artifact import read_artifact; obj = read_artifact(path)"
+}
+
+
+def _rollup_kb(pid):
+    # (Pss, Private_Clean + Private_Dirty) of a process in kB: shared pages count
+    # 1/n in the PSS of each of the n processes mapping them, the private part is the USS
+    values = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in ("Pss", "Private_Clean", "Private_Dirty"):
+                    values[key] = int(rest.split()[0])
+    except OSError:
+        return float("nan"), float("nan")
+    return values["Pss"], values["Private_Clean"] + values["Private_Dirty"]
+
+
+def _sample_rows(n=2000):
+    # encoded random fields over the app input range, None without compiled_encoder.joblib
+    if not os.path.exists("compiled_encoder.joblib"):
+        return None
+    import joblib
+    import pandas as pd
+    from recommendation import build_features
+    from recommendation_table import random_fields
+
+    encoder = joblib.load("compiled_encoder.joblib")
+    X = encoder.transform_array(build_features(random_fields(n)))
+    return pd.DataFrame(X, columns=encoder.columns)
+
+
+def _first_predict(obj, X):
+    # a mapped file is only read when a request walks the trees, memory is measured after
+    # (small batches, the scratch arrays of a big one would count as model memory)
+    model = obj[0] if isinstance(obj, tuple) else obj
+    if X is None or not hasattr(model, "predict"):
+        return False
+    sklearn = type(model).__module__.startswith("sklearn")
+    for start in range(0, len(X), 100):
+        batch = X.iloc[start:start + 100]
+        model.predict(batch if sklearn else batch.to_numpy())
+    return True
+
+
+def _measure(kind, path):
+    # runs in a fresh process so every load is a cold start, loads when a line
+    # arrives on stdin and stays alive until the next one (report reads its PSS)
+    import joblib, sklearn.ensemble  # noqa: F401  (import cost is not load cost)
+    import flat_forest, model_artifact  # noqa: F401
+    X = _sample_rows()
+    print("ready", flush=True)
+    sys.stdin.readline()
+
+    rss0, anon0 = _memory_kb()
+    start = time.perf_counter()
+    scope = {"path": path}
+    exec(_LOADERS[kind], scope)
+    elapsed = time.perf_counter() - start
+    predicted = _first_predict(scope["obj"], X)
+    rss1, anon1 = _memory_kb()
+    print(json.dumps({
+        "load_ms": elapsed * 1e3,
+        "predicted": predicted,
+        "rss_mb": (rss1 - rss0) / 1024,
+        "private_mb": (anon1 - anon0) / 1024
+    }), flush=True)
+    sys.stdin.readline()
+
+
+def measure_shared(kind, path, processes=2):
+    # load path in several processes at once, per process RSS, PSS and USS growth
+    cmd = [sys.executable, os.path.abspath(__file__), "--measure", kind, path]
+    env = {**os.environ, "PYTHONPATH": os.path.dirname(os.path.abspath(__file__))}
+    procs = [
+        subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, env=env)
+        for _ in range(processes)
+    ]
+    try:
+        for p in procs:
+            if p.stdout.readline().strip() != "ready":
+                raise RuntimeError(f"measuring {path} failed")
+        before = [_rollup_kb(p.pid) for p in procs]
+        for p in procs:
+            p.stdin.write("\n")
+            p.stdin.flush()
+        stats = [json.loads(p.stdout.readline()) for p in procs]
+        after = [_rollup_kb(p.pid) for p in procs]
+    finally:
+        for p in procs:
+            p.stdin.close()
+            p.wait()
+
+    out = {key: float(np.mean([s[key] for s in stats])) for key in ["load_ms", "rss_mb"]}
+    out["predicted"] = stats[0]["predicted"]
+    out["pss_mb"] = float(np.mean([a[0] - b[0] for a, b in zip(after, before)])) / 1024
+    out["uss_mb"] = float(np.mean([a[1] - b[1] for a, b in zip(after, before)])) / 1024
+    return out
+
+
+def report(paths, processes=2):
+    # memory after a first predict on 2000 random fields (models only), per process
+    # while `processes` processes hold the same file
+    print(f"{processes} processes, growth per process after loading (and predicting *)")
+    print(f"{'artifact':<28}{'size MB':>10}{'load ms':>10}{'RSS MB':>10}{'PSS MB':>10}{'USS MB':>10}")
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        kind = "flat" if path.endswith(".flat") else "npz" if path.endswith(".npz") else "joblib"
+        stats = measure_shared(kind, path, processes)
+        size = os.path.getsize(path) / 1024 ** 2
+        name = path + (" *" if stats["predicted"] else "")
+        print(f"{name:<28}{size:>10.2f}{stats['load_ms']:>10.1f}"
+              f"{stats['rss_mb']:>10.1f}{stats['pss_mb']:>10.1f}{stats['uss_mb']:>10.1f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--measure":
+        _measure(sys.argv[2], sys.argv[3])
+    elif len(sys.argv) == 2 and sys.argv[1] == "export":
+        import joblib
+        model = joblib.load("model.joblib")
+        encoder = joblib.load("compiled_encoder.joblib")
+        header = write_artifact("model.flat", FlatForest.from_sklearn(model), encoder)
+        print(f"model.flat written, version {header['version']}")
+    else:
+        report(sys.argv[1:] or [
+            "model.joblib",
+            "feature_encoders.joblib",
+            "target_encoders.joblib",
+            "compiled_encoder.joblib",
+            "flat_model.npz",
+            "model.flat"
+        ])
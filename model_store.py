@@ -0,0 +1,219 @@
+import os
+import sys
+import time
+import atexit
+import shutil
+import threading
+from collections import deque
+
+import numpy as np
+
+from model_artifact import read_artifact, read_header
+from recommendation import FEATURE_COLS, TARGET_COLS, CachedPredictor, build_features
+from request_log import RequestLog, close_on_signal
+
+'''
+Hot reloading model store for long-running processes (app, HTTP service).
+A background thread watches model.flat; when train_model.py writes a new
+version it is loaded, validated and swapped in as one object, so the forest,
+the encoder and the prediction cache always belong together. Requests read
+store.current once and keep using that version until they finish; the old
+file mapping stays valid after the rename.
+
+A version that fails validation is rejected and not retried. rollback()
+goes back to the previous version and rejects the current one, so the
+watcher does not load it again. For every process on the host at once,
+write_artifact keeps the replaced file as model.flat.prev and
+
+    python model_store.py rollback      puts model.flat.prev back
+    python model_store.py status        versions on disk
+'''
+
+
+class ModelVersion:
+    # everything one request needs, never changed after loading
+
+    def __init__(self, forest, encoder, header, request_log=None):
+        self.forest = forest
+        self.encoder = encoder
+        self.header = header
+        self.version = header["version"]
+        self.loaded_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+        # log(X, prediction) -> request ids, records which version answered
+        self.log = request_log.writer(self.version) if request_log else None
+        self.predictor = CachedPredictor(forest, encoder, encoder, maxsize=4096, log=self.log)
+
+
+def canary_fields(n=2000, seed=0):
+    # random fields with rule labels over everything that is served (wheat
+    # irrigation counts 0-10 like validate_model.py), a new model has to mostly
+    # agree with the rules
+    from recommendation_table import random_fields
+    from rule_predictor import predict_batch
+
+    df = build_features(random_fields(n, seed))
+    return df, predict_batch(df)
+
+
+def validate(candidate, canary, min_agreement=0.9):
+    # None when the version can be served, otherwise the reason
+    if candidate.encoder.columns != FEATURE_COLS:
+        return f"feature columns {candidate.encoder.columns} do not match {FEATURE_COLS}"
+    if list(candidate.encoder.target_classes) != TARGET_COLS:
+        return f"targets {list(candidate.encoder.target_classes)} do not match {TARGET_COLS}"
+
+    fields, labels = canary
+    try:
+        X = candidate.encoder.transform_array(fields)
+        prediction = candidate.forest.predict(X)
+        classes = candidate.encoder.decode(prediction)
+    except (ValueError, IndexError, KeyError) as e:
+        return f"canary prediction failed: {e}"
+
+    agreement = float((classes.to_numpy() == labels.to_numpy()).all(axis=1).mean())
+    if not np.isfinite(agreement) or agreement < min_agreement:
+        return f"canary agreement {agreement:.3f} below {min_agreement}"
+    return None
+
+
+class ModelStore:
+
+    def __init__(self, path="model.flat", poll_s=10.0, min_agreement=0.9, log_dir=None):
+        # log_dir: write every scored request to a request_log.RequestLog there
+        self.path = path
+        self.poll_s = poll_s
+        self.min_agreement = min_agreement
+        self.canary = canary_fields()
+        self.rejected = {}      # version -> reason
+        self.history = deque(maxlen=50)
+        self._lock = threading.Lock()  # serializes reload/rollback, readers never wait
+        self._thread = None
+        self._stop = threading.Event()
+
+        self._stamp = self._file_stamp()
+        forest, encoder, header = read_artifact(path)
+        self.request_log = None
+        if log_dir:
+            self.request_log = RequestLog(log_dir, encoder.columns, encoder.target_classes)
+            atexit.register(self.request_log.close)
+            close_on_signal(self.request_log)
+        first = ModelVersion(forest, encoder, header, self.request_log)
+        error = validate(first, self.canary, min_agreement)
+        if error:
+            raise ValueError(f"{path} version {first.version}: {error}")
+        self._current = first
+        self._previous = None
+        self._log("loaded", first.version)
+
+    @property
+    def current(self):
+        # read once per request, a plain attribute read is atomic
+        return self._current
+
+    @property
+    def version(self):
+        return self._current.version
+
+    def _file_stamp(self):
+        st = os.stat(self.path)
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _load(self):
+        forest, encoder, header = read_artifact(self.path)
+        return ModelVersion(forest, encoder, header, self.request_log)
+
+    def _log(self, event, version, detail=None):
+        self.history.append({
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "event": event,
+            "version": version,
+            **({"detail": detail} if detail else {})
+        })
+
+    def check(self):
+        # cheap stat, only reads the file when it changed
+        try:
+            stamp = self._file_stamp()
+        except FileNotFoundError:
+            return False
+        if stamp == self._stamp:
+            return False
+        self._stamp = stamp
+        return self.reload()
+
+    def reload(self):
+        with self._lock:
+            version = read_header(self.path)["version"]
+            if version == self._current.version or version in self.rejected:
+                return False
+
+            # the file may have been replaced again since the header was read
+            candidate = self._load()
+            error = validate(candidate, self.canary, self.min_agreement)
+            if error:
+                self.rejected[candidate.version] = error
+                self._log("rejected", candidate.version, error)
+                return False
+
+            self._previous, self._current = self._current, candidate
+            self._log("swapped", candidate.version)
+            return True
+
+    def rollback(self):
+        with self._lock:
+            if self._previous is None:
+                raise ValueError("No previous version to roll back to")
+            bad = self._current
+            self.rejected[bad.version] = "rolled back"
+            self._previous, self._current = None, self._previous
+            self._log("rolled back", self._current.version, f"from {bad.version}")
+            return self._current.version
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_s):
+            try:
+                self.check()
+            except Exception as e:  # a broken file must not kill the watcher
+                self._log("error", None, str(e))
+            if self.request_log is not None:
+                # segments of an idle process still reach the retrainer after max_age_s
+                self.request_log.close_expired()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch, name="model-watch", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self):
+        return {
+            "version": self._current.version,
+            "loaded_at": self._current.loaded_at,
+            "previous": self._previous.version if self._previous else None,
+            "rejected": dict(self.rejected),
+            "history": list(self.history)
+        }
+
+
+def rollback_file(path="model.flat"):
+    # restore path.prev, watching processes pick it up like a new version
+    previous = path + ".prev"
+    if not os.path.exists(previous):
+        raise ValueError(f"No {previous} to roll back to")
+    tmp_path = path + ".tmp"
+    shutil.copyfile(previous, tmp_path)
+    os.replace(tmp_path, path)
+    return read_header(path)["version"]
+
+
+if __name__ == "__main__":
+    path = sys.argv[2] if len(sys.argv) > 2 else "model.flat"
+    if len(sys.argv) > 1 and sys.argv[1] == "rollback":
+        print(f"{path} rolled back to version {rollback_file(path)}")
+    else:
+        for name in [path, path + ".prev"]:
+            if os.path.exists(name):
+                print(f"{name:<20}{read_header(name)['version']}")
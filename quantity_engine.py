@@ -0,0 +1,150 @@
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+'''
+Numeric fertilizer quantity engine.
+FERTILIZER_RANGES is compiled once into a (crop, nutrient, level, min/max)
+array, so quantities for any number of fields are a few fancy-index
+operations and stay numbers that can be summed. aggregate() adds up the
+field totals per farmer, village, district or any other column for
+procurement planning.
+
+    python quantity_engine.py fields.csv --by district village
+    python quantity_engine.py --benchmark 500000
+'''
+
+NUTRIENTS = ["N", "P", "K"]
+
+
+class RangeTable:
+
+    def __init__(self, ranges):
+        # ranges: {crop: {nutrient: {level: (min_kg, max_kg)}}} per acre
+        self.crops = sorted(ranges)
+        self.nutrients = NUTRIENTS
+        self.levels = []
+        for crop in ranges.values():
+            for nutrient in crop.values():
+                self.levels += [l for l in nutrient if l not in self.levels]
+
+        # NaN marks a level that has no range for that crop and nutrient
+        self.kg = np.full((len(self.crops), len(self.nutrients), len(self.levels), 2), np.nan)
+        for c, crop in enumerate(self.crops):
+            for n, nutrient in enumerate(self.nutrients):
+                for level, (low, high) in ranges[crop][nutrient].items():
+                    self.kg[c, n, self.levels.index(level)] = (low, high)
+        self.text = np.array([
+            [[f"{low:g}–{high:g} kg/acre" for low, high in nutrient] for nutrient in crop]
+            for crop in self.kg
+        ], dtype=object)
+
+    def _codes(self, values, categories, column):
+        values = np.asarray(values)
+        codes = pd.Categorical(values, categories=categories).codes
+        if (codes < 0).any():
+            unknown = sorted(set(values[codes < 0].astype(str)))
+            raise ValueError(f"Unknown values for {column}: {', '.join(unknown)}")
+        return codes
+
+    def _index(self, crops, nutrient, levels, crop_codes=None):
+        c = self._codes(crops, self.crops, "crop") if crop_codes is None else crop_codes
+        l = self._codes(levels, self.levels, f"{nutrient}_class")
+        n = self.nutrients.index(nutrient)
+        missing = np.isnan(self.kg[c, n, l, 0])
+        if missing.any():
+            pairs = sorted(set(zip(np.asarray(crops)[missing], np.asarray(levels)[missing])))
+            raise ValueError(
+                f"No {nutrient} range for: " + ", ".join(f"{c} {l}" for c, l in pairs)
+            )
+        return c, n, l
+
+    def per_acre(self, crops, nutrient, levels, crop_codes=None):
+        # (min_kg, max_kg) per acre arrays for one nutrient
+        kg = self.kg[self._index(crops, nutrient, levels, crop_codes)]
+        return kg[:, 0], kg[:, 1]
+
+    def per_acre_text(self, crops, nutrient, levels):
+        # "min–max kg/acre" labels, formatted once per table entry
+        return self.text[self._index(crops, nutrient, levels)]
+
+    def quantities(self, crops, classes, area):
+        # classes: DataFrame (or dict) with N_class, P_class, K_class
+        # returns numeric per acre ranges and field totals, one row per field
+        area = np.asarray(area, dtype=float)
+        crop_codes = self._codes(crops, self.crops, "crop")
+        out = {}
+        for nutrient in self.nutrients:
+            low, high = self.per_acre(crops, nutrient, classes[f"{nutrient}_class"], crop_codes)
+            out[f"{nutrient}_min_kg_per_acre"] = low
+            out[f"{nutrient}_max_kg_per_acre"] = high
+            out[f"{nutrient}_total_min_kg"] = low * area
+            out[f"{nutrient}_total_max_kg"] = high * area
+        index = classes.index if isinstance(classes, pd.DataFrame) else None
+        return pd.DataFrame(out, index=index)
+
+
+def total_columns():
+    return [f"{n}_total_{b}_kg" for n in NUTRIENTS for b in ["min", "max"]]
+
+
+def aggregate(fields, quantities, by):
+    # procurement totals per group, by: column name or list of them (farmer, village, district)
+    by = [by] if isinstance(by, str) else list(by)
+    df = pd.concat([fields[by + ["area_acres"]], quantities[total_columns()]], axis=1)
+    grouped = df.groupby(by, sort=True, observed=True)
+    out = grouped.sum()
+    out.insert(0, "fields", grouped.size())
+    return out.round(1)
+
+
+def random_fields(n, seed=0):
+    # synthetic fields with predicted classes, for the benchmark
+    rng = np.random.default_rng(seed)
+    levels = np.array(["low", "medium", "high"])
+    return pd.DataFrame({
+        "district": rng.choice([f"district_{i}" for i in range(22)], n),
+        "village": rng.choice([f"village_{i}" for i in range(2000)], n),
+        "farmer": rng.choice([f"farmer_{i}" for i in range(50000)], n),
+        "crop": rng.choice(["wheat", "rice"], n),
+        "area_acres": np.round(rng.uniform(0.5, 5.0, n), 2),
+        "N_class": rng.choice(levels, n),
+        "P_class": rng.choice(levels, n),
+        "K_class": rng.choice(levels[:2], n)
+    })
+
+
+if __name__ == "__main__":
+    from recommendation import RANGE_TABLE
+
+    parser = argparse.ArgumentParser(description="Fertilizer quantities and procurement totals")
+    parser.add_argument("fields", nargs="?",
+                        help="csv with crop, area_acres and N/P/K_class (e.g. the batch download)")
+    parser.add_argument("--by", nargs="+", default=["district"], help="group columns")
+    parser.add_argument("--output", help="write the grouped totals to this csv")
+    parser.add_argument("--benchmark", type=int, metavar="N",
+                        help="time quantities and aggregation on N random fields")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        fields = random_fields(args.benchmark)
+        start = time.perf_counter()
+        quantities = RANGE_TABLE.quantities(fields["crop"], fields, fields["area_acres"])
+        mid = time.perf_counter()
+        for by in [["farmer"], ["village"], ["district"]]:
+            aggregate(fields, quantities, by)
+        end = time.perf_counter()
+        print(f"{args.benchmark} fields: quantities {(mid - start) * 1e3:.1f} ms, "
+              f"3 aggregations {(end - mid) * 1e3:.1f} ms")
+    else:
+        if not args.fields:
+            parser.error("fields csv required")
+        fields = pd.read_csv(args.fields)
+        fields["crop"] = fields["crop"].str.strip().str.lower()
+        quantities = RANGE_TABLE.quantities(fields["crop"], fields, fields["area_acres"])
+        totals = aggregate(fields, quantities, args.by)
+        print(totals.to_string())
+        if args.output:
+            totals.to_csv(args.output)
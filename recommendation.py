@@ -0,0 +1,386 @@
+import os
+import json
+import warnings
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from fast_encoder import CompiledEncoder
+from instrumentation import stage
+from quantity_engine import RangeTable
+
+'''
+Recommendation pipeline shared by the app pages.
+Turns field inputs into model features, runs the model on the whole batch
+and converts the predicted classes into fertilizer quantities.
+'''
+
+# to get the amount for given acres
+TYPED_RANGES = {
+    "wheat": {
+        "N": {"low": (0, 10), "medium": (15, 20), "high": (25, 30)},
+        "P": {"low": (0, 5), "medium": (8, 12), "high": (15, 20)},
+        "K": {"low": (0, 5), "medium": (8, 12)}
+    },
+    "rice": {
+        "N": {"low": (0, 10), "medium": (15, 20), "high": (25, 30)},
+        "P": {"low": (0, 5), "medium": (8, 12), "high": (15, 20)},
+        "K": {"low": (0, 5), "medium": (8, 12)}
+    }
+}
+
+#doses extracted from the Package of Practices (python dose_tables.py) replace the
+#typed ranges only when asked for: FERT_RANGES=fertilizer_ranges.json
+RANGES_ENV = "FERT_RANGES"
+
+LEVEL_ORDER = ["low", "medium", "high"]
+
+
+def range_errors(ranges):
+    # why ranges can not replace the typed ones of their crops, [] when they can:
+    # the nutrients and levels of the typed ranges, low <= medium <= high
+    if not ranges:
+        return ["no crop"]
+    errors = []
+    for crop, nutrients in ranges.items():
+        if crop not in TYPED_RANGES:
+            errors.append(f"{crop}: unknown crop")
+            continue
+        for nutrient, typed in TYPED_RANGES[crop].items():
+            levels = nutrients.get(nutrient, {})
+            if set(levels) != set(typed):
+                errors.append(f"{crop} {nutrient}: levels {sorted(levels)}, "
+                              f"expected {sorted(typed)}")
+                continue
+            ordered = [level for level in LEVEL_ORDER if level in levels]
+            for level in ordered:
+                low, high = levels[level]
+                if not 0 <= low <= high:
+                    errors.append(f"{crop} {nutrient} {level}: {low}-{high} is not a range")
+            for lower, upper in zip(ordered, ordered[1:]):
+                if any(u < l for u, l in zip(levels[upper], levels[lower])):
+                    errors.append(f"{crop} {nutrient}: {upper} {levels[upper]} "
+                                  f"below {lower} {levels[lower]}")
+    return errors
+
+
+def load_ranges(path=None):
+    # the typed ranges, with the crops in path (dose_tables.py) replaced when they
+    # pass range_errors
+    if not path:
+        return TYPED_RANGES
+    with open(path) as f:
+        extracted = json.load(f)
+    ranges = {
+        crop: {
+            nutrient: {level: tuple(kg) for level, kg in levels.items()}
+            for nutrient, levels in nutrients.items()
+        }
+        for crop, nutrients in extracted.items()
+    }
+    errors = range_errors(ranges)
+    if errors:
+        warnings.warn(f"{path} not used, keeping the typed ranges: " + "; ".join(errors))
+        return TYPED_RANGES
+    return {**TYPED_RANGES, **ranges}
+
+
+FERTILIZER_RANGES = load_ranges(os.environ.get(RANGES_ENV))
+
+#same ranges as arrays, for whole batches
+RANGE_TABLE = RangeTable(FERTILIZER_RANGES)
+
+#columns in the order the model was trained on
+FEATURE_COLS = [
+    "crop",
+    "days_since_start",
+    "growth_stage",
+    "soil_type",
+    "prev_N",
+    "prev_P",
+    "prev_K",
+    "time_since_last_fertilizer",
+    "irrigation_count",
+    "time_since_last_irrigation",
+    "last_irrigation_level",
+    "area_acres"
+]
+
+#what the user enters for one field
+INPUT_COLS = [c for c in FEATURE_COLS if c != "growth_stage"]
+
+TARGET_COLS = ["N_class", "P_class", "K_class"]
+NUTRIENTS = ["N", "P", "K"]
+
+#text columns the app lower-cases before encoding
+LOWER_COLS = ["crop", "soil_type", "prev_N", "prev_P", "prev_K", "last_irrigation_level"]
+
+#last day of early and mid stage
+STAGE_CUTOFFS = {"wheat": (25, 60), "rice": (20, 50)}
+
+#last day the app accepts, a season schedule covers days 0 to this
+SEASON_DAYS = 200
+
+#accepted input values (the app input limits), irrigation_count for wheat only
+INPUT_LIMITS = {
+    "days_since_start": (0, SEASON_DAYS),
+    "area_acres": (0.1, 50.0),
+    "irrigation_count": (0, 10)
+}
+
+
+def compute_fertilizer_quantity(crop, nutrient, level, area):
+    min_kg, max_kg = FERTILIZER_RANGES[crop][nutrient][level]
+    return {
+        "per_acre": f"{min_kg}–{max_kg} kg/acre",
+        "total": f"{min_kg * area:.1f}–{max_kg * area:.1f} kg"
+    }
+
+#growth stage logic
+def get_wheat_stage(days):
+    if days <= 25:
+        return "early"
+    elif days <= 60:
+        return "mid"
+    else:
+        return "late"
+
+def get_rice_stage(days):
+    if days <= 20:
+        return "early"
+    elif days <= 50:
+        return "mid"
+    else:
+        return "late"
+
+
+def get_stages(crops, days):
+    # vectorized get_wheat_stage / get_rice_stage
+    early = np.select([crops == c for c in STAGE_CUTOFFS],
+                      [STAGE_CUTOFFS[c][0] for c in STAGE_CUTOFFS])
+    mid = np.select([crops == c for c in STAGE_CUTOFFS],
+                    [STAGE_CUTOFFS[c][1] for c in STAGE_CUTOFFS])
+    return np.where(days <= early, "early", np.where(days <= mid, "mid", "late"))
+
+
+def build_features(fields):
+    # fields: one row per field with the FEATURE_COLS inputs (growth_stage optional)
+    missing = [c for c in INPUT_COLS if c not in fields.columns]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+
+    df = pd.DataFrame(index=fields.index)
+    for col in INPUT_COLS:
+        df[col] = fields[col]
+    for col in LOWER_COLS:
+        df[col] = df[col].astype(str).str.strip().str.lower()
+    for col in ["time_since_last_fertilizer", "time_since_last_irrigation"]:
+        df[col] = df[col].astype(str).str.strip()
+
+    unknown = sorted(set(df["crop"]) - set(STAGE_CUTOFFS))
+    if unknown:
+        raise ValueError(f"Unknown crop: {', '.join(unknown)}")
+
+    # blank and non-numeric values become NaN and are reported with the out of range ones
+    errors = []
+    wheat = df["crop"] == "wheat"
+    for col, (low, high) in INPUT_LIMITS.items():
+        df[col] = pd.to_numeric(df[col], errors="coerce")
+        bad = ~df[col].between(low, high)
+        if col == "irrigation_count":
+            bad = wheat & (bad | (df[col] % 1 != 0))
+        if bad.any():
+            rows = [str(r) for r in df.index[bad]]
+            shown = ", ".join(rows[:10]) + (f" and {len(rows) - 10} more" if len(rows) > 10 else "")
+            what = "a whole number" if col == "irrigation_count" else "a number"
+            errors.append(f"{col} must be {what} from {low} to {high} (rows {shown})")
+    if errors:
+        raise ValueError("; ".join(errors))
+
+    df["growth_stage"] = get_stages(df["crop"].to_numpy(), df["days_since_start"].to_numpy())
+
+    # -1 means "not applicable" (rice)
+    df["irrigation_count"] = df["irrigation_count"].where(wheat).fillna(-1)
+    return df[FEATURE_COLS]
+
+
+def encode_features(df, feature_encoders):
+    if isinstance(feature_encoders, CompiledEncoder):
+        return feature_encoders.transform(df)
+
+    # LabelEncoder classes are sorted, so the position in classes_ is the code
+    encoded = df.copy()
+    for col, encoder in feature_encoders.items():
+        values = df[col].astype(str)
+        codes = pd.Categorical(values, categories=encoder.classes_).codes
+        if (codes < 0).any():
+            unknown = sorted(set(values[codes < 0]))
+            raise ValueError(f"Unknown values for {col}: {', '.join(unknown)}")
+        encoded[col] = codes.astype(np.int64)
+    return encoded
+
+
+def decode_targets(prediction, target_encoders):
+    if isinstance(target_encoders, CompiledEncoder):
+        return target_encoders.decode(prediction)
+
+    return pd.DataFrame({
+        col: target_encoders[col].classes_[prediction[:, i]]
+        for i, col in enumerate(TARGET_COLS)
+    })
+
+
+def predict_codes(df, model, feature_encoders):
+    # encoded features and predicted class codes
+    with stage("encode"):
+        X = encode_features(df, feature_encoders)
+    with stage("predict"):
+        prediction = np.asarray(model.predict(X), dtype=np.int64)
+    return X, prediction
+
+
+def predict_classes(df, model, feature_encoders, target_encoders, log=None):
+    # one model.predict call for the whole batch
+    # both encoder arguments can also be the same CompiledEncoder
+    # log(X, prediction) -> request ids (request_log.py) adds a request_id column
+    X, prediction = predict_codes(df, model, feature_encoders)
+    with stage("decode"):
+        classes = decode_targets(prediction, target_encoders)
+        classes.index = df.index
+    if log is not None:
+        with stage("log"):
+            classes["request_id"] = log(np.asarray(X, dtype=np.float32), prediction)
+    return classes
+
+
+def add_quantities(df, classes):
+    # adds per acre range and field totals for every row
+    out = classes.copy()
+    crops = df["crop"].to_numpy()
+    quantities = RANGE_TABLE.quantities(crops, classes, df["area_acres"])
+    for nutrient in NUTRIENTS:
+        levels = classes[f"{nutrient}_class"].to_numpy()
+        out[f"{nutrient}_per_acre"] = RANGE_TABLE.per_acre_text(crops, nutrient, levels)
+        out[f"{nutrient}_total_min_kg"] = quantities[f"{nutrient}_total_min_kg"].round(1)
+        out[f"{nutrient}_total_max_kg"] = quantities[f"{nutrient}_total_max_kg"].round(1)
+    return out
+
+
+def recommend_batch(fields, model, feature_encoders, target_encoders, predictor=None, log=None):
+    # predictor(df) -> classes can replace the model (e.g. the rule engine)
+    with stage("build_features"):
+        df = build_features(fields)
+    if predictor is None:
+        classes = predict_classes(df, model, feature_encoders, target_encoders, log=log)
+    else:
+        with stage("predict"):
+            classes = predictor(df)
+    with stage("quantities"):
+        quantities = add_quantities(df, classes)
+    extra = fields[[c for c in fields.columns if c not in FEATURE_COLS]]
+    return pd.concat([extra, df, quantities], axis=1)
+
+
+def season_fields(key, last_day=SEASON_DAYS):
+    # the field of a normalize_field key once for every day of the season
+    df = pd.DataFrame(dict(zip(INPUT_COLS, key)), index=range(last_day + 1))
+    df["days_since_start"] = np.arange(last_day + 1)
+    return df
+
+
+def schedule_windows(df, classes):
+    # consecutive days with the same stage and N/P/K classes become one window
+    keys = pd.concat([df[["growth_stage"]], classes[TARGET_COLS]], axis=1)
+    window = (keys != keys.shift()).any(axis=1).cumsum()
+    days = df["days_since_start"].groupby(window)
+    out = keys.groupby(window).first()
+    out.insert(0, "from_day", days.min())
+    out.insert(1, "to_day", days.max())
+    return out.reset_index(drop=True)
+
+
+def season_schedule(key, predictor, last_day=SEASON_DAYS):
+    # key: normalize_field output (its days are not used), predictor(df) -> classes
+    # every day is scored in one batch, the windows get quantities for the field
+    with stage("build_features"):
+        df = build_features(season_fields(key, last_day))
+    classes = predictor(df)
+    with stage("quantities"):
+        windows = schedule_windows(df, classes)
+        crop, area = key[0], key[-1]
+        for nutrient in NUTRIENTS:
+            qty = [
+                compute_fertilizer_quantity(crop, nutrient, level, area)
+                for level in windows[f"{nutrient}_class"]
+            ]
+            windows[f"{nutrient}_per_acre"] = [q["per_acre"] for q in qty]
+            windows[f"{nutrient}_total"] = [q["total"] for q in qty]
+    return windows
+
+
+def normalize_field(crop, days, soil_type, prev_n, prev_p, prev_k, time_since_fert,
+                    irrigation_count, time_since_irr, irr_level, area):
+    # same field always gives the same key, in INPUT_COLS order
+    crop = crop.strip().lower()
+    if crop == "rice" or irrigation_count is None or pd.isna(irrigation_count):
+        irrigation_count = -1
+    return (
+        crop,
+        int(days),
+        soil_type.strip().lower(),
+        prev_n.strip().lower(),
+        prev_p.strip().lower(),
+        prev_k.strip().lower(),
+        time_since_fert.strip(),
+        int(irrigation_count),
+        time_since_irr.strip(),
+        irr_level.strip().lower(),
+        float(area)
+    )
+
+
+class CachedPredictor:
+    # memoizes N/P/K classes per field, shared by every session of the process
+    # with a log (request_log.py) every call is logged, cache hits too
+    # season schedules are cached per field profile, they are not logged
+
+    def __init__(self, model, feature_encoders, target_encoders, maxsize=4096, log=None):
+        self.model = model
+        self.feature_encoders = feature_encoders
+        self.target_encoders = target_encoders
+        self.log = log
+        self._cached = lru_cache(maxsize=maxsize)(self._predict)
+        self._schedules = lru_cache(maxsize=256)(self._schedule)
+
+    def _predict(self, key):
+        with stage("dataframe"):
+            df = pd.DataFrame([dict(zip(INPUT_COLS, key))])
+        with stage("build_features"):
+            df = build_features(df)
+        X, prediction = predict_codes(df, self.model, self.feature_encoders)
+        with stage("decode"):
+            classes = decode_targets(prediction, self.target_encoders)
+        return tuple(classes.iloc[0]), np.asarray(X, dtype=np.float32), prediction
+
+    def predict(self, *field):
+        # field arguments as in normalize_field, returns (N, P, K)
+        classes, X, prediction = self._cached(normalize_field(*field))
+        if self.log is not None:
+            with stage("log"):
+                self.log(X, prediction)
+        return classes
+
+    def _classes(self, df):
+        return predict_classes(df, self.model, self.feature_encoders, self.target_encoders)
+
+    def _schedule(self, key):
+        return season_schedule(key, self._classes)
+
+    def schedule(self, *field):
+        # field arguments as in normalize_field, days does not matter
+        key = normalize_field(*field)
+        return self._schedules(key[:1] + (0,) + key[2:]).copy()
+
+    def cache_info(self):
+        return self._cached.cache_info()
@@ -0,0 +1,302 @@
+import os
+import json
+import mmap
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from recommendation import (
+    FEATURE_COLS, TARGET_COLS, STAGE_CUTOFFS,
+    get_wheat_stage, get_rice_stage, normalize_field, build_features
+)
+
+'''
+Materialized recommendation table.
+The categorical inputs have a small finite space, so every valid
+combination is scored once with the model and the N/P/K class codes are
+stored in a dense int8 array indexed by the encoded tuple (mixed radix).
+A request is then one index computation and one array read.
+
+The labels do not depend on area and depend on days only through the
+growth stage, so each stage is scored at one representative day and all
+fields at one reference area. verify() measures how often that agrees with
+the live model on random fields. The forest does split on days and area,
+so the table is an approximation (about 98% agreement) and stays an
+offline tool, the app and the service always answer with the forest.
+
+Layout (recommendation_table.bin), read through a read-only mmap:
+    8 bytes   magic b"RECTAB01"
+    8 bytes   little endian header length
+    header    json: key columns and values, classes, model version
+    table     int8 (combinations, targets), -1 for invalid combinations
+
+    python recommendation_table.py build --min-agreement 0.98
+                                  not written below 98% agreement with the model
+    python recommendation_table.py verify --samples 20000
+'''
+
+MAGIC = b"RECTAB01"
+FORMAT_VERSION = 1
+ALIGN = 64
+
+#index order of the table, growth_stage replaces days
+KEY_COLS = [
+    "crop",
+    "growth_stage",
+    "soil_type",
+    "prev_N",
+    "prev_P",
+    "prev_K",
+    "time_since_last_fertilizer",
+    "irrigation_count",
+    "time_since_last_irrigation",
+    "last_irrigation_level"
+]
+
+#-1 is rice, 0-10 is the wheat range of the app
+IRRIGATION_COUNTS = list(range(-1, 11))
+
+#days seen in training, representative days are stage midpoints inside it
+DAY_RANGE = (5, 120)
+
+#middle of the training areas (0.5-5 acres)
+REFERENCE_AREA = 2.75
+
+
+def representative_day(crop, stage):
+    early, mid = STAGE_CUTOFFS[crop]
+    low, high = {
+        "early": (DAY_RANGE[0], early),
+        "mid": (early + 1, mid),
+        "late": (mid + 1, DAY_RANGE[1])
+    }[stage]
+    return (low + high) // 2
+
+
+def key_values(encoder):
+    # same vocabulary as the model encoder
+    return {
+        col: IRRIGATION_COUNTS if col == "irrigation_count"
+        else [str(v) for v in encoder.feature_classes[col]]
+        for col in KEY_COLS
+    }
+
+
+class RecommendationTable:
+
+    def __init__(self, header, table):
+        self.header = header
+        self.table = table  # int8 (combinations, targets)
+        self.values = header["values"]
+        self.target_classes = [np.array(header["target_classes"][c], dtype=object) for c in TARGET_COLS]
+
+        shape = [len(self.values[c]) for c in KEY_COLS]
+        self.strides = np.array(
+            [int(np.prod(shape[i + 1:])) for i in range(len(shape))], dtype=np.int64
+        )
+        self._dicts = [{v: i for i, v in enumerate(self.values[c])} for c in KEY_COLS]
+        self._indexes = [pd.Index(self.values[c]) for c in KEY_COLS]
+
+    def _row(self, index):
+        row = self.table[index]
+        if row[0] < 0:
+            raise ValueError("Field combination is not valid (irrigation count is for wheat only)")
+        return row
+
+    def index(self, key):
+        # key: values in KEY_COLS order
+        i = 0
+        for lookup, stride, value, col in zip(self._dicts, self.strides, key, KEY_COLS):
+            try:
+                i += lookup[value] * stride
+            except KeyError:
+                raise ValueError(f"Value {value!r} for {col} is not in the table") from None
+        return int(i)
+
+    def lookup(self, *field):
+        # field arguments as in normalize_field, returns (N, P, K)
+        (crop, days, soil, prev_n, prev_p, prev_k, fert,
+         irr_count, irr_time, irr_level, _area) = normalize_field(*field)
+        stage = get_rice_stage(days) if crop == "rice" else get_wheat_stage(days)
+        row = self._row(self.index(
+            (crop, stage, soil, prev_n, prev_p, prev_k, fert, irr_count, irr_time, irr_level)
+        ))
+        return tuple(classes[code] for classes, code in zip(self.target_classes, row))
+
+    def lookup_codes(self, df):
+        # df: build_features output, returns target codes (rows, targets)
+        index = np.zeros(len(df), dtype=np.int64)
+        for col, values, stride in zip(KEY_COLS, self._indexes, self.strides):
+            column = df[col].astype(int) if col == "irrigation_count" else df[col].astype(str)
+            codes = values.get_indexer(column)
+            if (codes < 0).any():
+                unknown = sorted(set(column[codes < 0].astype(str)))
+                raise ValueError(f"Values for {col} not in the table: {', '.join(unknown)}")
+            index += codes * stride
+        rows = self.table[index]
+        if (rows[:, 0] < 0).any():
+            raise ValueError("Field combination is not valid (irrigation count is for wheat only)")
+        return rows
+
+    def lookup_batch(self, df):
+        # same output as predict_classes, usable as recommend_batch(predictor=...)
+        rows = self.lookup_codes(df)
+        return pd.DataFrame({
+            col: classes[rows[:, i]]
+            for i, (col, classes) in enumerate(zip(TARGET_COLS, self.target_classes))
+        }, index=df.index)
+
+
+def enumerate_fields(values):
+    # every valid key combination as a build_features-style frame, in table order
+    shape = [len(values[c]) for c in KEY_COLS]
+    codes = np.indices(shape).reshape(len(shape), -1)
+    df = pd.DataFrame({
+        col: np.asarray(values[col], dtype=object)[codes[i]] for i, col in enumerate(KEY_COLS)
+    })
+    valid = (df["crop"] == "rice") == (df["irrigation_count"] == -1)
+
+    df = df[valid.to_numpy()].copy()
+    df["irrigation_count"] = df["irrigation_count"].astype(int)
+    df["days_since_start"] = [
+        representative_day(crop, stage) for crop, stage in zip(df["crop"], df["growth_stage"])
+    ]
+    df["area_acres"] = REFERENCE_AREA
+    return df[FEATURE_COLS], np.flatnonzero(valid.to_numpy()), int(np.prod(shape))
+
+
+def build(forest, encoder, model_version=None, chunk_rows=65536):
+    values = key_values(encoder)
+    fields, positions, size = enumerate_fields(values)
+
+    table = np.full((size, len(TARGET_COLS)), -1, dtype=np.int8)
+    for start in range(0, len(fields), chunk_rows):
+        X = encoder.transform_array(fields.iloc[start:start + chunk_rows])
+        table[positions[start:start + chunk_rows]] = forest.predict(X)
+
+    header = {
+        "format": FORMAT_VERSION,
+        "model_version": model_version,
+        "values": values,
+        "target_classes": {c: [str(v) for v in k] for c, k in encoder.target_classes.items()},
+        "reference_area": REFERENCE_AREA,
+        "days": {
+            crop: {stage: representative_day(crop, stage) for stage in ["early", "mid", "late"]}
+            for crop in STAGE_CUTOFFS
+        },
+        "shape": list(table.shape)
+    }
+    return RecommendationTable(header, table)
+
+
+def write_table(path, table):
+    raw = json.dumps(table.header).encode("utf-8")
+    raw += b" " * ((-(len(MAGIC) + 8 + len(raw))) % ALIGN)
+
+    # write next to the target and rename, readers never see half a file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(raw).to_bytes(8, "little"))
+        f.write(raw)
+        f.write(np.ascontiguousarray(table.table, dtype=np.int8).tobytes())
+    os.replace(tmp_path, path)
+
+
+def read_table(path):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a recommendation table")
+        size = int.from_bytes(f.read(8), "little")
+        header = json.loads(f.read(size))
+        if header["format"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported table format {header['format']} in {path}")
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    count = int(np.prod(header["shape"]))
+    table = np.frombuffer(buf, dtype=np.int8, count=count, offset=len(MAGIC) + 8 + size)
+    return RecommendationTable(header, table.reshape(header["shape"]))
+
+
+def random_fields(n, seed=0):
+    # random fields over the whole app input range (days 0-200, area 0.1-50,
+    # the wheat IRRIGATION_COUNTS)
+    rng = np.random.default_rng(seed)
+    crops = rng.choice(["wheat", "rice"], n)
+    wheat_counts = [c for c in IRRIGATION_COUNTS if c >= 0]
+    return pd.DataFrame({
+        "crop": crops,
+        "days_since_start": rng.integers(0, 201, n),
+        "soil_type": rng.choice(["sandy", "loamy", "clay"], n),
+        "prev_N": rng.choice(["none", "low", "medium", "high"], n),
+        "prev_P": rng.choice(["none", "low", "medium", "high"], n),
+        "prev_K": rng.choice(["none", "low", "medium", "high"], n),
+        "time_since_last_fertilizer": rng.choice(["<15", "15-30", ">30"], n),
+        "irrigation_count": np.where(crops == "rice", -1, rng.choice(wheat_counts, n)),
+        "time_since_last_irrigation": rng.choice(["<7", "7-20", ">20"], n),
+        "last_irrigation_level": rng.choice(["light", "normal", "heavy"], n),
+        "area_acres": np.round(rng.uniform(0.1, 50.0, n), 2)
+    })
+
+
+def verify(table, forest, encoder, samples=20000, seed=0):
+    # share of random fields where the table gives the live model's classes
+    df = build_features(random_fields(samples, seed))
+    live = forest.predict(encoder.transform_array(df))
+    stored = table.lookup_codes(df)
+    same = live == stored
+    result = {f"agree_{col}": float(same[:, i].mean()) for i, col in enumerate(TARGET_COLS)}
+    result["agree_all"] = float(same.all(axis=1).mean())
+
+    # same check inside the training range, where the model has seen data
+    seen = (df["days_since_start"].between(*DAY_RANGE) & df["area_acres"].between(0.5, 5.0)).to_numpy()
+    result["agree_all_training_range"] = float(same[seen].all(axis=1).mean())
+    return result
+
+
+if __name__ == "__main__":
+    from model_artifact import read_artifact
+
+    parser = argparse.ArgumentParser(description="Build or check the recommendation lookup table")
+    parser.add_argument("command", choices=["build", "verify"])
+    parser.add_argument("--artifact", default="model.flat")
+    parser.add_argument("--output", default="recommendation_table.bin")
+    parser.add_argument("--samples", type=int, default=20000)
+    parser.add_argument("--min-agreement", type=float,
+                        help="build: only write the table when agree_all is at least this")
+    args = parser.parse_args()
+
+    forest, encoder, model_header = read_artifact(args.artifact)
+
+    if args.command == "build":
+        # checked against the live model before anything is written
+        start = time.perf_counter()
+        table = build(forest, encoder, model_header["version"])
+        valid = int((table.table[:, 0] >= 0).sum())
+        print(f"{valid} combinations scored in {time.perf_counter() - start:.1f} s")
+    else:
+        table = read_table(args.output)
+        if table.header["model_version"] != model_header["version"]:
+            print(f"warning: table was built for model {table.header['model_version']}, "
+                  f"{args.artifact} is {model_header['version']}")
+
+    result = verify(table, forest, encoder, args.samples)
+    for name, value in result.items():
+        print(f"{name:<28}{value:.4f}")
+
+    if args.command == "build":
+        if args.min_agreement is not None and result["agree_all"] < args.min_agreement:
+            parser.exit(1, f"agreement {result['agree_all']:.4f} below {args.min_agreement}, "
+                           f"{args.output} not written\n")
+        write_table(args.output, table)
+        print(f"{os.path.getsize(args.output) / 1024 ** 2:.2f} MB written to {args.output}")
+        table = read_table(args.output)
+
+    field = ("Wheat", 30, "Loamy", "Low", "Medium", "None", "15-30", 2, "7-20", "Normal", 1.0)
+    table.lookup(*field)
+    start = time.perf_counter()
+    for _ in range(10000):
+        table.lookup(*field)
+    print(f"lookup: {(time.perf_counter() - start) / 10000 * 1e6:.1f} µs per field")
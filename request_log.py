@@ -0,0 +1,326 @@
+import os
+import glob
+import json
+import time
+import random
+import signal
+import threading
+
+import numpy as np
+
+'''
+Append-only binary log of scored requests.
+Every prediction is written as one fixed-size record: request id, time,
+the encoded feature row (float32, model column order) and the predicted
+class codes. Outcomes reported later go to separate feedback records with
+the same request id, nothing is ever rewritten.
+
+Files in the log directory:
+    requests-<start>-<pid>-<rand>.log     closed request segment
+    requests-<start>-<pid>-<rand>.open    segment being written
+    feedback-<start>-<pid>-<rand>.log     outcome records (same rotation)
+<start> is the open time (YYYYmmddHHMMSS), <rand> 8 random hex digits so
+two logs of one process never share a name.
+
+Each file starts with
+    8 bytes   magic b"REQLOG01"
+    8 bytes   little endian header length
+    header    json: kind, model version, columns, classes, record dtype
+followed by packed records. A segment is closed (renamed to .log) when it
+reaches max_bytes, is older than max_age_s (checked on append and by
+close_expired, which the model store calls on every watch tick), the model
+version changes or the process exits; readers only use closed segments.
+Records are flushed to the file on every append, so a killed process loses
+none: its .open segments are closed by the next RequestLog on the directory
+or by incremental_training.py (recover_segments, only for pids that are
+gone). close_on_signal also closes the segments on SIGTERM/SIGINT.
+
+Turned on in the app with FERT_REQUEST_LOG=<dir>, in inference_service.py
+with --request-log <dir>; incremental_training.py consumes the closed
+segments.
+'''
+
+MAGIC = b"REQLOG01"
+ALIGN = 64
+
+
+def request_dtype(n_features, n_targets):
+    return np.dtype([
+        ("id", "<u8"),
+        ("time", "<f8"),
+        ("features", "<f4", (n_features,)),
+        ("predicted", "i1", (n_targets,))
+    ])
+
+
+def feedback_dtype(n_targets):
+    return np.dtype([
+        ("id", "<u8"),
+        ("time", "<f8"),
+        ("outcome", "i1", (n_targets,))
+    ])
+
+
+class _Segment:
+    # one open file of one kind, rotated by the owning RequestLog
+
+    def __init__(self, directory, kind, header, dtype):
+        self.kind = kind
+        self.dtype = dtype
+        self.started = time.time()
+        stamp = time.strftime("%Y%m%d%H%M%S")
+        self.name = os.path.join(
+            directory, f"{kind}-{stamp}-{os.getpid()}-{random.getrandbits(32):08x}"
+        )
+        raw = json.dumps({**header, "kind": kind, "dtype": dtype.descr}).encode("utf-8")
+        raw += b" " * ((-(len(MAGIC) + 8 + len(raw))) % ALIGN)
+        self.file = open(self.name + ".open", "wb")
+        self.file.write(MAGIC)
+        self.file.write(len(raw).to_bytes(8, "little"))
+        self.file.write(raw)
+        self.size = self.file.tell()
+
+    def write(self, records):
+        # flushed every time, a killed process leaves whole records behind
+        self.file.write(records.tobytes())
+        self.file.flush()
+        self.size += records.nbytes
+
+    def close(self):
+        self.file.close()
+        os.replace(self.name + ".open", self.name + ".log")
+
+
+class RequestLog:
+
+    def __init__(self, directory, columns, target_classes, max_bytes=16 * 1024 ** 2,
+                 max_age_s=3600):
+        # columns: model feature order, target_classes: {target: classes}
+        os.makedirs(directory, exist_ok=True)
+        recover_segments(directory)
+        self.directory = directory
+        self.columns = list(columns)
+        self.target_cols = list(target_classes)
+        self.target_classes = {c: [str(v) for v in k] for c, k in target_classes.items()}
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_s
+        self._request_dtype = request_dtype(len(self.columns), len(self.target_cols))
+        self._feedback_dtype = feedback_dtype(len(self.target_cols))
+        self._segments = {}
+        self._version = None
+        self._lock = threading.Lock()
+        # ids: random 32 bit process tag and a counter, unique across workers
+        self._tag = random.getrandbits(31) << 32
+        self._counter = 0
+
+    def _header(self):
+        return {
+            "version": self._version,
+            "columns": self.columns,
+            "target_classes": self.target_classes
+        }
+
+    def _expired(self, segment):
+        return time.time() - segment.started >= self.max_age_s
+
+    def _segment(self, kind, dtype):
+        segment = self._segments.get(kind)
+        if segment is not None and (segment.size >= self.max_bytes or self._expired(segment)):
+            segment.close()
+            segment = None
+        if segment is None:
+            segment = _Segment(self.directory, kind, self._header(), dtype)
+            self._segments[kind] = segment
+        return segment
+
+    def append(self, X, predicted, version):
+        # X: encoded rows in model column order, predicted: class codes
+        # returns the request ids
+        X = np.asarray(X)
+        records = np.empty(len(X), dtype=self._request_dtype)
+        records["time"] = time.time()
+        records["features"] = X
+        records["predicted"] = predicted
+        with self._lock:
+            if version != self._version:
+                self._close_all()
+                self._version = version
+            ids = self._tag + self._counter + np.arange(len(X), dtype=np.uint64)
+            self._counter += len(X)
+            records["id"] = ids
+            self._segment("requests", self._request_dtype).write(records)
+        return ids
+
+    def feedback(self, request_ids, outcome):
+        # outcome: class codes per target, -1 where unknown
+        request_ids = np.atleast_1d(np.asarray(request_ids, dtype=np.uint64))
+        records = np.empty(len(request_ids), dtype=self._feedback_dtype)
+        records["id"] = request_ids
+        records["time"] = time.time()
+        records["outcome"] = np.asarray(outcome).reshape(len(request_ids), -1)
+        with self._lock:
+            self._segment("feedback", self._feedback_dtype).write(records)
+
+    def outcome_codes(self, labels):
+        # {target: label or None} -> codes, -1 for missing
+        codes = []
+        for col in self.target_cols:
+            label = labels.get(col)
+            if label is None:
+                codes.append(-1)
+            elif str(label) in self.target_classes[col]:
+                codes.append(self.target_classes[col].index(str(label)))
+            else:
+                raise ValueError(f"Unknown {col} {label!r}")
+        return codes
+
+    def writer(self, version):
+        # callable(X, predicted) -> ids for one model version
+        return lambda X, predicted: self.append(X, predicted, version)
+
+    def flush(self):
+        with self._lock:
+            for segment in self._segments.values():
+                segment.file.flush()
+
+    def close_expired(self):
+        # closes segments older than max_age_s without waiting for the next append,
+        # called periodically so an idle process does not keep its rows unreadable
+        with self._lock:
+            for kind, segment in list(self._segments.items()):
+                if self._expired(segment):
+                    segment.close()
+                    del self._segments[kind]
+
+    def _close_all(self):
+        for segment in self._segments.values():
+            segment.close()
+        self._segments = {}
+
+    def close(self, timeout=-1):
+        # False when the lock was not free within timeout (seconds, -1 waits)
+        if not self._lock.acquire(timeout=timeout):
+            return False
+        try:
+            self._close_all()
+        finally:
+            self._lock.release()
+        return True
+
+
+def close_on_signal(log, signals=(signal.SIGTERM, signal.SIGINT)):
+    # closes log on these signals, then runs the handler that was installed before
+    # (SIGTERM default: exit with 128 + signum). Only the main thread can install
+    # handlers, elsewhere (a Streamlit script thread) this returns False and the
+    # segments are left to recover_segments.
+    if threading.current_thread() is not threading.main_thread():
+        return False
+    previous = {signum: signal.getsignal(signum) for signum in signals}
+
+    def handler(signum, frame):
+        # the signal can arrive while this thread holds the log lock in append,
+        # the atexit close runs once the stack has unwound
+        log.close(timeout=1.0)
+        before = previous[signum]
+        if callable(before):
+            before(signum, frame)
+        elif before == signal.SIG_DFL:
+            raise SystemExit(128 + signum)
+
+    for signum in signals:
+        signal.signal(signum, handler)
+    return True
+
+
+# ---- reading ----
+
+def _read_header(f, path):
+    # (header, record dtype), f is left at the first record
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError(f"{path} is not a request log segment")
+    size = int.from_bytes(f.read(8), "little")
+    header = json.loads(f.read(size))
+    return header, np.dtype([tuple(field) for field in header["dtype"]])
+
+
+def read_segment(path):
+    # (header, records) of one closed segment
+    with open(path, "rb") as f:
+        header, dtype = _read_header(f, path)
+        records = np.fromfile(f, dtype=dtype)
+    return header, records
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # someone else's process
+        return True
+    return True
+
+
+def recover_segments(directory):
+    # closes the .open segments of processes that are gone, returns the new .log paths
+    recovered = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.open"))):
+        try:
+            pid = int(os.path.basename(path).split("-")[2])
+        except (IndexError, ValueError):
+            continue
+        if pid == os.getpid() or _pid_alive(pid):
+            continue
+        try:
+            with open(path, "r+b") as f:
+                _, dtype = _read_header(f, path)
+                start = f.tell()
+                end = os.fstat(f.fileno()).st_size
+                # a record cut by the kill is dropped
+                f.truncate(start + (end - start) // dtype.itemsize * dtype.itemsize)
+        except (ValueError, OSError):
+            continue  # header not complete, nothing was logged
+        log_path = path[:-len(".open")] + ".log"
+        os.replace(path, log_path)
+        recovered.append(log_path)
+    return recovered
+
+
+def closed_segments(directory, kind="requests"):
+    return sorted(glob.glob(os.path.join(directory, f"{kind}-*.log")))
+
+
+def read_feedback(paths):
+    # (request ids, outcome codes) of the feedback records in paths, oldest first
+    records = [read_segment(path)[1] for path in paths]
+    if not records:
+        return np.empty(0, dtype=np.uint64), np.empty((0, 0), dtype=np.int8)
+    records = np.concatenate(records)
+    records = records[np.argsort(records["time"], kind="stable")]
+    return records["id"], records["outcome"]
+
+
+if __name__ == "__main__":
+    import sys
+    import tempfile
+
+    if len(sys.argv) > 1 and sys.argv[1] != "bench":
+        # summary of a log directory
+        for kind in ["requests", "feedback"]:
+            paths = closed_segments(sys.argv[1], kind)
+            rows = sum(len(read_segment(p)[1]) for p in paths)
+            print(f"{kind:<10}{len(paths):>6} segments{rows:>12} records")
+    else:
+        columns = [f"f{i}" for i in range(12)]
+        classes = {t: ["high", "low", "medium"] for t in ["N_class", "P_class", "K_class"]}
+        with tempfile.TemporaryDirectory() as directory:
+            log = RequestLog(directory, columns, classes)
+            X = np.zeros((1, 12))
+            predicted = np.zeros((1, 3), dtype=np.int64)
+            n = 100_000
+            start = time.perf_counter()
+            for _ in range(n):
+                log.append(X, predicted, "bench")
+            elapsed = time.perf_counter() - start
+            log.close()
+            print(f"append: {elapsed / n * 1e6:.2f} µs per request")
@@ -0,0 +1,195 @@
+import numpy as np
+import pandas as pd
+
+from fast_generator import (
+    LEVELS, SOILS, PREV_LEVELS, FERT_TIMES, IRR_TIMES, IRR_LEVELS,
+    STAGE_BASE, STAGE_CUTOFFS, SOIL_SHIFT, PREV_SHIFT, FERT_TIME_SHIFT,
+    get_stage_codes, apply_rules
+)
+
+'''
+Rule engine predictor.
+Evaluates the same rules that made the training labels, so it gives the
+exact N/P/K classes without running the Random Forest. Takes the same
+feature columns as the model (see Home.py).
+'''
+
+TARGET_COLS = ["N_class", "P_class", "K_class"]
+
+#string -> code for the single field path
+_CODES = {
+    "soil_type": {v: i for i, v in enumerate(SOILS)},
+    "prev": {v: i for i, v in enumerate(PREV_LEVELS)},
+    "time_since_last_fertilizer": {v: i for i, v in enumerate(FERT_TIMES)},
+    "time_since_last_irrigation": {v: i for i, v in enumerate(IRR_TIMES)},
+    "last_irrigation_level": {v: i for i, v in enumerate(IRR_LEVELS)}
+}
+
+#python lists are faster than numpy for one value at a time
+_BASE = {crop: table.tolist() for crop, table in STAGE_BASE.items()}
+_CUTOFFS = {crop: cutoffs.tolist() for crop, cutoffs in STAGE_CUTOFFS.items()}
+_SOIL_SHIFT = SOIL_SHIFT.tolist()
+_PREV_SHIFT = PREV_SHIFT.tolist()
+_FERT_TIME_SHIFT = FERT_TIME_SHIFT.tolist()
+_LEVELS = LEVELS.tolist()
+
+
+def _code(mapping, value, column):
+    try:
+        return mapping[value]
+    except KeyError:
+        raise ValueError(f"Unknown value {value!r} for {column}") from None
+
+
+def _clip(level):
+    return 0 if level < 0 else 2 if level > 2 else level
+
+
+def predict_one(crop, days, soil_type, prev_n, prev_p, prev_k,
+                time_since_fert, time_since_irr, irr_level, irrigation_count=-1):
+    crop = crop.lower()
+    if crop not in _BASE:
+        raise ValueError(f"Unknown crop {crop!r}")
+
+    soil = _code(_CODES["soil_type"], soil_type.lower(), "soil_type")
+    prev = [
+        _code(_CODES["prev"], level.lower(), col)
+        for level, col in [(prev_n, "prev_N"), (prev_p, "prev_P"), (prev_k, "prev_K")]
+    ]
+    fert_time = _code(_CODES["time_since_last_fertilizer"], time_since_fert,
+                      "time_since_last_fertilizer")
+    irr_time = _code(_CODES["time_since_last_irrigation"], time_since_irr,
+                     "time_since_last_irrigation")
+    irr = _code(_CODES["last_irrigation_level"], irr_level.lower(),
+                "last_irrigation_level")
+
+    early, mid = _CUTOFFS[crop]
+    stage = 0 if days <= early else 1 if days <= mid else 2
+    n, p, k = _BASE[crop][stage]
+    fert_shift = _FERT_TIME_SHIFT[fert_time]
+
+    # Nitrogen
+    n = _clip(n + _PREV_SHIFT[prev[0]])
+    n = _clip(n + _SOIL_SHIFT[soil])
+    if crop == "wheat" and irrigation_count >= 2:
+        n = _clip(n + 1)
+    n = _clip(n + fert_shift)
+    if irr_time == 0 or irr == 2:
+        n = _clip(n + 1)
+
+    # Phosphorus
+    p = _clip(_clip(p + _PREV_SHIFT[prev[1]]) + fert_shift)
+
+    # Potassium (never high)
+    k = min(1, _clip(_clip(k + _PREV_SHIFT[prev[2]]) + fert_shift))
+
+    return {"N": _LEVELS[n], "P": _LEVELS[p], "K": _LEVELS[k]}
+
+
+def _column_codes(df, column, table):
+    values = df[column].astype(str).str.lower()
+    codes = pd.Categorical(values, categories=table).codes
+    if (codes < 0).any():
+        unknown = sorted(set(values[codes < 0]))
+        raise ValueError(f"Unknown values {unknown} for {column}")
+    return codes
+
+
+def predict_batch(df):
+    # df has the model feature columns, both crops can be mixed
+    crops = df["crop"].astype(str).str.lower().to_numpy()
+    unknown = set(crops) - set(STAGE_BASE)
+    if unknown:
+        raise ValueError(f"Unknown crop {sorted(unknown)}")
+
+    soil = _column_codes(df, "soil_type", SOILS)
+    prev_n = _column_codes(df, "prev_N", PREV_LEVELS)
+    prev_p = _column_codes(df, "prev_P", PREV_LEVELS)
+    prev_k = _column_codes(df, "prev_K", PREV_LEVELS)
+    fert_time = _column_codes(df, "time_since_last_fertilizer", FERT_TIMES)
+    irr_time = _column_codes(df, "time_since_last_irrigation", IRR_TIMES)
+    irr_level = _column_codes(df, "last_irrigation_level", IRR_LEVELS)
+    days = df["days_since_start"].to_numpy()
+    if "irrigation_count" in df.columns:
+        irr_count = df["irrigation_count"].fillna(-1).to_numpy()
+    else:
+        irr_count = np.full(len(df), -1)
+
+    out = np.zeros((len(df), 3), dtype=np.int8)
+    for crop in STAGE_BASE:
+        mask = crops == crop
+        if not mask.any():
+            continue
+        n, p, k = apply_rules(
+            crop,
+            get_stage_codes(crop, days[mask]),
+            soil[mask],
+            prev_n[mask],
+            prev_p[mask],
+            prev_k[mask],
+            fert_time[mask],
+            irr_time[mask],
+            irr_level[mask],
+            irr_count[mask]
+        )
+        out[mask] = np.column_stack([n, p, k])
+
+    return pd.DataFrame(LEVELS[out], columns=TARGET_COLS, index=df.index)
+
+
+def predict_model(df, model, feature_encoders, target_encoders):
+    # same encoding as Home.py, on a whole batch
+    X = df.copy()
+    X["irrigation_count"] = X["irrigation_count"].fillna(-1)
+    for col, encoder in feature_encoders.items():
+        X[col] = encoder.transform(X[col].astype(str))
+
+    prediction = model.predict(X)
+    return pd.DataFrame({
+        col: target_encoders[col].inverse_transform(prediction[:, i])
+        for i, col in enumerate(TARGET_COLS)
+    }, index=df.index)
+
+
+def consistency_report(df, model, feature_encoders, target_encoders):
+    # rows where the Random Forest and the rules do not agree
+    rules = predict_batch(df)
+    forest = predict_model(df, model, feature_encoders, target_encoders)
+
+    differs = (rules != forest).any(axis=1)
+    report = df[differs].copy()
+    for col in TARGET_COLS:
+        report[f"rule_{col}"] = rules.loc[differs, col]
+        report[f"model_{col}"] = forest.loc[differs, col]
+
+    summary = {col: float((rules[col] == forest[col]).mean()) for col in TARGET_COLS}
+    summary["all"] = float(1 - differs.mean())
+    return report, summary
+
+
+if __name__ == "__main__":
+    import time
+    import joblib
+    from fast_generator import generate_dataset, DAY_COLUMN
+
+    model = joblib.load("model.joblib")
+    feature_encoders = joblib.load("feature_encoders.joblib")
+    target_encoders = joblib.load("target_encoders.joblib")
+
+    frames = []
+    for crop in ["wheat", "rice"]:
+        sample = generate_dataset(crop, 20_000, seed=7)
+        frames.append(sample.rename(columns={DAY_COLUMN[crop]: "days_since_start"}))
+    df = pd.concat(frames, ignore_index=True).drop(columns=TARGET_COLS)
+    df = df.astype({col: str for col in df.columns if df[col].dtype == "category"})
+
+    start = time.perf_counter()
+    for _ in range(10_000):
+        predict_one("wheat", 30, "loamy", "low", "none", "medium", "15-30", "<7", "normal", 2)
+    print(f"single field: {(time.perf_counter() - start) / 10_000 * 1e6:.1f} µs")
+
+    report, summary = consistency_report(df, model, feature_encoders, target_encoders)
+    print("agreement with the Random Forest:", summary)
+    print(f"{len(report)} of {len(df)} rows disagree")
+    if len(report):
+        print(report.head(20).to_string())
@@ -0,0 +1,92 @@
+import os
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from fast_generator import draw_features, label_features, to_frame
+
+'''
+Sharded dataset generation.
+N rows are split into fixed size shards, every shard gets its own seed made
+from (seed, shard number) so the output does not depend on how many workers
+run (only on seed, shard size and chunk size). Each worker writes its shard
+to disk chunk by chunk, so memory stays the same no matter how big N is.
+'''
+
+
+def shard_sizes(n_rows, shard_rows):
+    sizes = [shard_rows] * (n_rows // shard_rows)
+    if n_rows % shard_rows:
+        sizes.append(n_rows % shard_rows)
+    return sizes
+
+
+def shard_path(out_dir, crop, shard_idx):
+    return os.path.join(out_dir, f"{crop}_part_{shard_idx:05d}.csv")
+
+
+def write_shard(crop, shard_idx, n_rows, seed, out_dir, chunk_rows):
+    rng = np.random.default_rng([seed, shard_idx])
+    path = shard_path(out_dir, crop, shard_idx)
+    tmp_path = path + ".tmp"
+
+    written = 0
+    with open(tmp_path, "w", newline="") as f:
+        while written < n_rows:
+            size = min(chunk_rows, n_rows - written)
+            features = draw_features(crop, size, rng)
+            df = to_frame(crop, features, label_features(crop, features))
+            df.to_csv(f, index=False, header=(written == 0))
+            written += size
+
+    # a half written shard never looks finished
+    os.replace(tmp_path, path)
+    return path
+
+
+def _write_shard(args):
+    return write_shard(*args)
+
+
+def generate_sharded(crop, n_rows, out_dir, seed=42, shard_rows=1_000_000,
+                     chunk_rows=200_000, workers=None):
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = [
+        (crop, idx, size, seed, out_dir, chunk_rows)
+        for idx, size in enumerate(shard_sizes(n_rows, shard_rows))
+    ]
+
+    if workers == 1:
+        return [_write_shard(job) for job in jobs]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_write_shard, jobs))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a dataset in shards")
+    parser.add_argument("crop", choices=["wheat", "rice"])
+    parser.add_argument("n_rows", type=int)
+    parser.add_argument("--out-dir", default="shards")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--shard-rows", type=int, default=1_000_000)
+    parser.add_argument("--chunk-rows", type=int, default=200_000)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    paths = generate_sharded(
+        args.crop,
+        args.n_rows,
+        args.out_dir,
+        seed=args.seed,
+        shard_rows=args.shard_rows,
+        chunk_rows=args.chunk_rows,
+        workers=args.workers
+    )
+    elapsed = time.perf_counter() - start
+
+    print(f"{len(paths)} shards written to {args.out_dir}")
+    print(f"{args.n_rows / elapsed:,.0f} rows/sec")
@@ -0,0 +1,144 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+'''
+App startup tools.
+
+    python startup.py icon          decode icon.avif once into icon.png
+    python startup.py measure       import, icon, model load and first render
+                                    times, each in a fresh process
+
+--baseline OLD_Home.py adds the first render time of another version of the
+app (e.g. git show HEAD~1:Home.py > Home_old.py) for a before/after view.
+'''
+
+ICON_SIZE = 256  # sidebar width, the browser gets it without resizing
+
+#modules the app imports before it can draw anything
+IMPORT_SETS = {
+    # the original Home.py (joblib unpickles the sklearn forest)
+    "original": ["streamlit", "pandas", "numpy", "joblib", "sklearn.ensemble", "PIL.Image"],
+    # before lazy imports
+    "eager": [
+        "streamlit", "pandas", "numpy", "PIL.Image", "instrumentation",
+        "model_store", "rule_predictor", "recommendation_table", "recommendation"
+    ],
+    # now, everything else is loaded by the warm-up thread
+    "lazy": ["streamlit", "instrumentation"]
+}
+
+
+def export_icon(src="icon.avif", dst="icon.png", size=ICON_SIZE):
+    from PIL import Image
+
+    img = Image.open(src)
+    img.thumbnail((size, size))
+    img.save(dst, optimize=True)
+    return img.size
+
+
+def _run(code):
+    # fresh interpreter so nothing is imported or cached yet
+    here = os.path.dirname(os.path.abspath(__file__))
+    out = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True,
+        env={**os.environ, "PYTHONPATH": here}
+    )
+    if out.returncode != 0:
+        return None
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def time_imports(modules):
+    available = [m for m in modules if _run(f"import {m}; print('{{}}')") is not None]
+    code = (
+        "import time, json\n"
+        "start = time.perf_counter()\n"
+        + "".join(f"import {m}\n" for m in available)
+        + "print(json.dumps({'ms': (time.perf_counter() - start) * 1e3}))"
+    )
+    result = _run(code)
+    return result["ms"], [m for m in modules if m not in available]
+
+
+def time_icon():
+    code = (
+        "import time, json\n"
+        "from PIL import Image\n"
+        "start = time.perf_counter()\n"
+        "img = Image.open('icon.avif'); img.load()\n"
+        "avif = time.perf_counter() - start\n"
+        "start = time.perf_counter()\n"
+        "data = open('icon.png', 'rb').read()\n"
+        "png = time.perf_counter() - start\n"
+        "print(json.dumps({'avif_ms': avif * 1e3, 'png_ms': png * 1e3}))"
+    )
+    return _run(code)
+
+
+def time_model_load(path="model.flat"):
+    code = (
+        "import time, json\n"
+        "start = time.perf_counter()\n"
+        "from model_store import ModelStore\n"
+        f"ModelStore({path!r})\n"
+        "print(json.dumps({'ms': (time.perf_counter() - start) * 1e3}))"
+    )
+    return _run(code)
+
+
+def time_first_render(app):
+    # script run until the page is drawn, needs streamlit
+    code = (
+        "import time, json\n"
+        "start = time.perf_counter()\n"
+        "from streamlit.testing.v1 import AppTest\n"
+        f"at = AppTest.from_file({app!r}, default_timeout=120).run()\n"
+        "print(json.dumps({'ms': (time.perf_counter() - start) * 1e3,"
+        " 'errors': [str(e.value) for e in at.exception]}))"
+    )
+    return _run(code)
+
+
+def measure(app="Home.py", baseline=None):
+    print("imports before the first render")
+    for name, modules in IMPORT_SETS.items():
+        ms, missing = time_imports(modules)
+        note = f"  (not installed: {', '.join(missing)})" if missing else ""
+        print(f"  {name:<10}{ms:>10.1f} ms{note}")
+
+    if os.path.exists("icon.png") and os.path.exists("icon.avif"):
+        icon = time_icon()
+        if icon:
+            print(f"icon: decode icon.avif {icon['avif_ms']:.1f} ms, read icon.png {icon['png_ms']:.2f} ms")
+
+    if os.path.exists("model.flat"):
+        load = time_model_load()
+        if load:
+            print(f"model warm-up (background thread): {load['ms']:.1f} ms")
+
+    for name, path in [("now", app), ("baseline", baseline)]:
+        if not path:
+            continue
+        render = time_first_render(path)
+        if render is None:
+            print(f"first render ({name}): streamlit is not installed")
+            break
+        print(f"first render ({name}, {path}): {render['ms']:.1f} ms"
+              + (f", errors: {render['errors']}" if render["errors"] else ""))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="App startup tools")
+    parser.add_argument("command", choices=["icon", "measure"])
+    parser.add_argument("--app", default="Home.py")
+    parser.add_argument("--baseline", help="another Home.py to compare the first render with")
+    args = parser.parse_args()
+
+    if args.command == "icon":
+        print(f"icon.png written, {export_icon()} pixels")
+    else:
+        measure(args.app, args.baseline)
@@ -1,84 +1,480 @@
+import os
+import time
+import argparse
+import tempfile
+from contextlib import contextmanager
+
 import pandas as pd
 import numpy as np
 import joblib
 
-from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import LabelEncoder
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.multioutput import MultiOutputClassifier
 from sklearn.metrics import classification_report
 
-# to load dataset
-df = pd.read_csv("final_dataset.csv")
-
-# we will shuffle dataset
-df = df.sample(frac=1, random_state=42).reset_index(drop=True)
-
-#handling of NaN
-# -1 means "not applicable" (rice)
-if "irrigation_count" in df.columns:
-    df["irrigation_count"] = df["irrigation_count"].fillna(-1)
+from fast_encoder import CompiledEncoder
+from flat_forest import FlatForest, route_forests
+from model_artifact import write_artifact
+from columnar import read_dataset
 
 # labels and features
 target_cols = ["N_class", "P_class", "K_class"]
-X = df.drop(columns=target_cols)
-y = df[target_cols]
+
+# row count column of a deduplicated dataset (dedup_dataset.py)
+weight_col = "weight"
+
+
+def load_dataset(path="final_dataset.csv"):
+    # to load dataset (csv or parquet), text columns as categories
+    df = read_dataset(path, categorical=True)
+
+    # we will shuffle dataset
+    df = df.sample(frac=1, random_state=42).reset_index(drop=True)
+
+    #handling of NaN
+    # -1 means "not applicable" (rice)
+    if "irrigation_count" in df.columns:
+        df["irrigation_count"] = df["irrigation_count"].fillna(-1).astype(np.int8)
+    return df
+
+
+def is_text(series):
+    # csv gives object columns, parquet gives categoricals
+    return series.dtype == "object" or isinstance(series.dtype, pd.CategoricalDtype)
+
+
+def category_codes(series):
+    # LabelEncoder codes (sorted classes) from the category codes, no string per row
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.astype("category")
+    codes = series.cat.codes.to_numpy()
+    if (codes < 0).any():
+        raise ValueError(f"Missing values in {series.name}")
+
+    # parquet dictionaries can hold categories no row uses, LabelEncoder only sees used ones
+    used = np.flatnonzero(np.bincount(codes, minlength=len(series.cat.categories)))
+    classes = series.cat.categories[used].astype(str).to_numpy(dtype=str)
+    order = np.argsort(classes)
+    remap = np.zeros(len(series.cat.categories), dtype=np.min_scalar_type(len(classes)))
+    remap[used[order]] = np.arange(len(classes))
+    return remap[codes], classes[order]
+
+
+def encode_dataset(df):
+    # one contiguous float32 feature matrix (what sklearn fits on) and int8 targets,
+    # filled column by column so no int64 or object copies are made
+    feature_cols = [c for c in df.columns if c not in target_cols]
+    X = np.empty((len(df), len(feature_cols)), dtype=np.float32)
+    label_encoders = {}
+
+    for i, col in enumerate(feature_cols):
+        if is_text(df[col]):
+            X[:, i], classes = category_codes(df[col])
+            label_encoders[col] = LabelEncoder().fit(classes)
+        else:
+            X[:, i] = df[col].to_numpy()
+
+    # Encode targets
+    y = np.empty((len(df), len(target_cols)), dtype=np.int8)
+    target_encoders = {}
+    for i, col in enumerate(target_cols):
+        y[:, i], classes = category_codes(df[col])
+        target_encoders[col] = LabelEncoder().fit(classes)
+
+    # DataFrames over the same arrays, keeps the column names for sklearn
+    X = pd.DataFrame(X, columns=feature_cols, copy=False)
+    y = pd.DataFrame(y, columns=target_cols, copy=False)
+    return X, y, label_encoders, target_encoders
+
+
+def split_rows(arrays, test_size=0.2):
+    # load_dataset already shuffled the rows, so the split is two slices (views)
+    n_test = int(np.ceil(len(arrays[0]) * test_size))
+    n_train = len(arrays[0]) - n_test
+    out = []
+    for a in arrays:
+        out += [a[:n_train], a[n_train:]] if isinstance(a, np.ndarray) else [a.iloc[:n_train], a.iloc[n_train:]]
+    return out
+
+
+# ---- memory ----
+
+def _rss_mb():
+    # (current, peak) resident set size in MB
+    values = {}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in ("VmRSS", "VmHWM"):
+                    values[key] = int(rest.split()[0]) / 1024
+    except OSError:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        values = {"VmRSS": peak, "VmHWM": peak}
+    return values.get("VmRSS", 0.0), values.get("VmHWM", 0.0)
+
+
+def _reset_peak():
+    # linux: the peak starts again from the current RSS, elsewhere it is the process peak
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+@contextmanager
+def track_memory(name, report):
+    # adds RSS before/after and the peak of one training phase to report
+    if report is None:
+        yield
+        return
+    reset = _reset_peak()
+    before, _ = _rss_mb()
+    start = time.perf_counter()
+    yield
+    after, peak = _rss_mb()
+    report[name] = {
+        "seconds": time.perf_counter() - start,
+        "rss_before_mb": before,
+        "rss_after_mb": after,
+        "peak_mb": peak,
+        "peak_is_phase": reset
+    }
+
+
+def print_memory(report):
+    print(f"\n{'phase':<10}{'seconds':>10}{'RSS before':>12}{'RSS after':>12}{'peak MB':>10}")
+    for name, m in report.items():
+        note = "" if m["peak_is_phase"] else "  (process peak)"
+        print(f"{name:<10}{m['seconds']:>10.2f}{m['rss_before_mb']:>12.1f}"
+              f"{m['rss_after_mb']:>12.1f}{m['peak_mb']:>10.1f}{note}")
+
+
+def build_model(n_estimators=200, max_depth=12):
+    base_model = RandomForestClassifier(
+        n_estimators=n_estimators,
+        max_depth=max_depth,
+        random_state=42,
+        n_jobs=-1
+    )
+    return MultiOutputClassifier(base_model)
+
+
+def build_native_model(n_estimators=200, max_depth=12):
+    # one forest whose trees predict N, P and K together
+    return RandomForestClassifier(
+        n_estimators=n_estimators,
+        max_depth=max_depth,
+        random_state=42,
+        n_jobs=-1
+    )
+
+
+def crop_feature_columns(columns, crop):
+    # crop is constant inside a crop model, rice has no irrigation_count
+    drop = {"crop"} | ({"irrigation_count"} if crop == "rice" else set())
+    return [c for c in columns if c not in drop]
+
+
+def fit_model(X_train, y_train, label_encoders, native=False, per_crop=False,
+              n_estimators=200, max_depth=12, sample_weight=None):
+    build = build_native_model if native else build_model
+    if not per_crop:
+        model = build(n_estimators, max_depth)
+        model.fit(X_train, y_train, sample_weight=sample_weight)
+        return model
+
+    # {crop: (model, feature columns)}, routed by crop at prediction time
+    models = {}
+    crop_codes = label_encoders["crop"].transform(label_encoders["crop"].classes_)
+    for crop, code in zip(label_encoders["crop"].classes_, crop_codes):
+        rows = X_train["crop"] == code
+        columns = crop_feature_columns(X_train.columns, crop)
+        model = build(n_estimators, max_depth)
+        weight = None if sample_weight is None else np.asarray(sample_weight)[rows.to_numpy()]
+        model.fit(X_train.loc[rows, columns], y_train[rows], sample_weight=weight)
+        models[crop] = (model, columns)
+    return models
+
+
+def export_flat(model, label_encoders, columns):
+    # FlatForest over the full feature matrix for any of the fit_model layouts
+    if not isinstance(model, dict):
+        return FlatForest.from_sklearn(model)
+
+    columns = list(columns)
+    forests = {}
+    for crop, (crop_model, crop_columns) in model.items():
+        code = int(label_encoders["crop"].transform([crop])[0])
+        index = [columns.index(c) for c in crop_columns]
+        forests[code] = FlatForest.from_sklearn(crop_model, feature_index=index)
+    return route_forests(columns.index("crop"), forests)
+
+
+def train(path="final_dataset.csv", native=False, per_crop=False,
+          n_estimators=200, max_depth=12, memory=None):
+    # memory: dict that gets the RSS of the load, encode and fit phases
+    with track_memory("load", memory):
+        df = load_dataset(path)
+        weights = df.pop(weight_col).to_numpy() if weight_col in df.columns else None
+    with track_memory("encode", memory):
+        X, y, label_encoders, target_encoders = encode_dataset(df)
+        del df
+
+    #train test split
+    arrays = [X, y] if weights is None else [X, y, weights]
+    split = split_rows(arrays, test_size=0.2)
+    X_train, X_test, y_train, y_test = split[:4]
+    sample_weight = None if weights is None else split[4]
+
+    # model
+    with track_memory("fit", memory):
+        model = fit_model(
+            X_train, y_train, label_encoders,
+            native=native, per_crop=per_crop,
+            n_estimators=n_estimators, max_depth=max_depth,
+            sample_weight=sample_weight
+        )
+
+    return model, label_encoders, target_encoders, X_test, y_test
+
+
+# ---- chunked (out-of-core) training ----
+
+def iter_chunks(path, chunk_rows):
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        chunks = (
+            batch.to_pandas()
+            for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows)
+        )
+    else:
+        chunks = pd.read_csv(path, chunksize=chunk_rows)
+    for chunk in chunks:
+        if "irrigation_count" in chunk.columns:
+            chunk["irrigation_count"] = chunk["irrigation_count"].fillna(-1)
+        yield chunk
+
+
+def spool_chunks(path, chunk_rows, directory):
+    # first pass: every row encoded once into two flat files in directory, float32
+    # features and int16 targets. Text columns get codes in order of appearance, the
+    # LabelEncoder (sorted) order is only known at the end, remaps[col] maps one to
+    # the other. Returns (rows, columns, label_encoders, target_encoders, remaps)
+    tables = None
+    rows = 0
+    with open(os.path.join(directory, "X.f32"), "wb") as fx, \
+            open(os.path.join(directory, "y.i16"), "wb") as fy:
+        for chunk in iter_chunks(path, chunk_rows):
+            if tables is None:
+                columns = [c for c in chunk.columns if c not in target_cols]
+                tables = {c: {} for c in chunk.columns if is_text(chunk[c])}
+            codes = {}
+            for col, table in tables.items():
+                first, uniques = pd.factorize(chunk[col].astype(str))
+                codes[col] = np.array([table.setdefault(u, len(table)) for u in uniques])[first]
+
+            X = np.empty((len(chunk), len(columns)), dtype=np.float32)
+            for i, col in enumerate(columns):
+                X[:, i] = codes[col] if col in codes else chunk[col].to_numpy()
+            fx.write(X.tobytes())
+            fy.write(np.column_stack([codes[col] for col in target_cols]).astype(np.int16).tobytes())
+            rows += len(chunk)
+    if not rows:
+        raise ValueError(f"No rows in {path}")
+
+    label_encoders, target_encoders, remaps = {}, {}, {}
+    for col, table in tables.items():
+        values = np.array(list(table), dtype=str)
+        le = LabelEncoder().fit(values)
+        remaps[col] = le.transform(values)
+        if col in target_cols:
+            target_encoders[col] = le
+        else:
+            label_encoders[col] = le
+    return rows, columns, label_encoders, target_encoders, remaps
+
+
+def spooled_rows(X_spool, y_spool, rows, columns, remaps):
+    # (X, y) of the given rows (sorted), text columns as LabelEncoder codes
+    X = X_spool[rows]
+    for i, col in enumerate(columns):
+        if col in remaps:
+            X[:, i] = remaps[col][X[:, i].astype(np.int64)]
+    y = np.column_stack([remaps[col][y_spool[rows, i]] for i, col in enumerate(target_cols)])
+    return X, y
+
+
+def merge_forests(forests):
+    # one forest holding the trees of all chunk forests
+    merged = forests[0]
+    for forest in forests[1:]:
+        merged.estimators_ += forest.estimators_
+    merged.n_estimators = len(merged.estimators_)
+    return merged
+
+
+def train_chunked(path="final_dataset.csv", chunk_rows=500_000, trees_per_chunk=20,
+                  max_depth=12, val_fraction=0.2, max_val_rows=200_000, memory=None,
+                  spool_dir=None):
+    # the encoded rows are spooled to disk (spool_dir, default the temp directory,
+    # ~50 bytes per row) so the second pass can read them in random order
+    with tempfile.TemporaryDirectory(dir=spool_dir) as directory:
+        with track_memory("scan", memory):
+            rows, columns, label_encoders, target_encoders, remaps = spool_chunks(
+                path, chunk_rows, directory
+            )
+        X_spool = np.memmap(os.path.join(directory, "X.f32"), dtype=np.float32, mode="r",
+                            shape=(rows, len(columns)))
+        y_spool = np.memmap(os.path.join(directory, "y.i16"), dtype=np.int16, mode="r",
+                            shape=(rows, len(target_cols)))
+        with track_memory("fit", memory):
+            model, X_test, y_test = _fit_chunks(
+                X_spool, y_spool, columns, remaps, target_encoders, chunk_rows,
+                trees_per_chunk, max_depth, val_fraction, max_val_rows
+            )
+        del X_spool, y_spool
+    return model, label_encoders, target_encoders, X_test, y_test
+
+
+def _fit_chunks(X_spool, y_spool, columns, remaps, target_encoders, chunk_rows,
+                trees_per_chunk, max_depth, val_fraction, max_val_rows):
+    rng = np.random.default_rng(42)
+
+    # files are often sorted (all wheat rows, then rice), every chunk is a random
+    # sample of the whole file instead
+    order = rng.permutation(len(y_spool))
+    n_val = min(int(len(order) * val_fraction), max_val_rows)
+    val_rows, order = np.sort(order[:n_val]), order[n_val:]
+
+    forests = {col: [] for col in target_cols}
+    pending = []
+
+    for start in range(0, len(order), chunk_rows):
+        X, y = spooled_rows(
+            X_spool, y_spool, np.sort(order[start:start + chunk_rows]), columns, remaps
+        )
+
+        # every chunk forest must see all classes, otherwise wait for more rows
+        pending.append((X, y))
+        X = np.concatenate([p[0] for p in pending])
+        y = np.concatenate([p[1] for p in pending])
+        complete = all(
+            len(np.unique(y[:, i])) == len(target_encoders[col].classes_)
+            for i, col in enumerate(target_cols)
+        )
+        if not complete:
+            continue
+        pending = []
+
+        for i, col in enumerate(target_cols):
+            forest = RandomForestClassifier(
+                n_estimators=trees_per_chunk,
+                max_depth=max_depth,
+                random_state=int(rng.integers(2 ** 31)),
+                n_jobs=-1
+            )
+            forest.fit(pd.DataFrame(X, columns=columns), y[:, i])
+            forests[col].append(forest)
+        print(f"chunk done: {sum(len(f) for f in forests[target_cols[0]])} trees per target")
+
+    if not forests[target_cols[0]]:
+        raise ValueError("Not enough rows to see every class of every target")
+    if pending:
+        print(f"{sum(len(p[1]) for p in pending)} rows of the last chunk not used: "
+              f"they do not hold every class")
+
+    model = build_model()
+    model.estimators_ = [merge_forests(forests[col]) for col in target_cols]
+    model.n_features_in_ = len(columns)
+
+    X_val, y_val = spooled_rows(X_spool, y_spool, val_rows, columns, remaps)
+    X_test = pd.DataFrame(X_val, columns=columns)
+    y_test = pd.DataFrame(y_val, columns=target_cols)
+    return model, X_test, y_test
 
 
-label_encoders = {}
+def print_report(model, X_test, y_test):
+    #evaluation
+    y_pred = model.predict(X_test)
 
-for col in X.columns:
-    if X[col].dtype == "object":
-        le = LabelEncoder()
-        X[col] = le.fit_transform(X[col].astype(str))
-        label_encoders[col] = le
+    print("\n=== NITROGEN (N) ===")
+    print(classification_report(y_test.iloc[:, 0], y_pred[:, 0]))
 
-# Encode targets
-target_encoders = {}
-for col in y.columns:
-    le = LabelEncoder()
-    y[col] = le.fit_transform(y[col])
-    target_encoders[col] = le
+    print("\n=== PHOSPHORUS (P) ===")
+    print(classification_report(y_test.iloc[:, 1], y_pred[:, 1]))
 
-#train test split
-X_train, X_test, y_train, y_test = train_test_split(
-    X, y, test_size=0.2, random_state=42
-)
+    print("\n=== POTASSIUM (K) ===")
+    print(classification_report(y_test.iloc[:, 2], y_pred[:, 2]))
 
-# model
-base_model = RandomForestClassifier(
-    n_estimators=200,
-    max_depth=12,
-    random_state=42,
-    n_jobs=-1
-)
 
-model = MultiOutputClassifier(base_model)
+def save_artifacts(model, label_encoders, target_encoders, columns):
+    # Saveing trained model
+    joblib.dump(model, "model.joblib")
 
+    # Save feature encoders
+    joblib.dump(label_encoders, "feature_encoders.joblib")
 
-model.fit(X_train, y_train)
+    # Save target encoders
+    joblib.dump(target_encoders, "target_encoders.joblib")
 
-#evaluation
-y_pred = model.predict(X_test)
+    # Save compiled encoder (all features and targets in one artifact)
+    encoder = CompiledEncoder.from_label_encoders(list(columns), label_encoders, target_encoders)
+    joblib.dump(encoder, "compiled_encoder.joblib")
 
-print("\n=== NITROGEN (N) ===")
-print(classification_report(y_test.iloc[:, 0], y_pred[:, 0]))
+    # Save flat array copy of the forests (memory-mappable, used by the app)
+    write_artifact("model.flat", export_flat(model, label_encoders, columns), encoder)
 
-print("\n=== PHOSPHORUS (P) ===")
-print(classification_report(y_test.iloc[:, 1], y_pred[:, 1]))
 
-print("\n=== POTASSIUM (K) ===")
-print(classification_report(y_test.iloc[:, 2], y_pred[:, 2]))
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the fertilizer model")
+    parser.add_argument("--data", default="final_dataset.csv")
+    parser.add_argument("--chunk-rows", type=int,
+                        help="stream the dataset in chunks of this many rows (for big datasets)")
+    parser.add_argument("--trees-per-chunk", type=int, default=20)
+    parser.add_argument("--native", action="store_true",
+                        help="one multi-output forest instead of one forest per target")
+    parser.add_argument("--per-crop", action="store_true",
+                        help="a separate model per crop, routed by crop")
+    parser.add_argument("--n-estimators", type=int, default=200)
+    parser.add_argument("--max-depth", type=int, default=12)
+    parser.add_argument("--min-agreement", type=float,
+                        help="only save the model if it agrees with the rules on at least this "
+                             "share of all input combinations (validate_model.py)")
+    args = parser.parse_args()
 
+    if args.chunk_rows and (args.native or args.per_crop):
+        parser.error("--native and --per-crop are not supported with --chunk-rows")
 
+    memory = {}
+    if args.chunk_rows:
+        model, label_encoders, target_encoders, X_test, y_test = train_chunked(
+            args.data, args.chunk_rows, args.trees_per_chunk, args.max_depth, memory=memory
+        )
+    else:
+        model, label_encoders, target_encoders, X_test, y_test = train(
+            args.data, native=args.native, per_crop=args.per_crop,
+            n_estimators=args.n_estimators, max_depth=args.max_depth, memory=memory
+        )
+    print_memory(memory)
+    print_report(export_flat(model, label_encoders, X_test.columns), X_test, y_test)
 
-# Saveing trained model
-joblib.dump(model, "model.joblib")
+    if args.min_agreement is not None:
+        from validate_model import validate, summarize
 
-# Save feature encoders
-joblib.dump(label_encoders, "feature_encoders.joblib")
+        encoder = CompiledEncoder.from_label_encoders(
+            list(X_test.columns), label_encoders, target_encoders
+        )
+        fields, _, _, differs = validate(model, encoder)
+        agreement = summarize(fields, differs)["agree_all"]
+        print(f"agreement with the rules on all {len(fields)} input combinations: {agreement:.4f}")
+        if agreement < args.min_agreement:
+            parser.exit(1, f"below {args.min_agreement}, model not saved\n")
 
-# Save target encoders
-joblib.dump(target_encoders, "target_encoders.joblib")
+    save_artifacts(model, label_encoders, target_encoders, X_test.columns)
 
-print("Model and encoders saved successfully")
+    print("Model and encoders saved successfully")
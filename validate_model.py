@@ -0,0 +1,255 @@
+import sys
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from fast_generator import (
+    LEVELS, STAGES, SOILS, PREV_LEVELS, FERT_TIMES, IRR_TIMES, IRR_LEVELS, apply_rules
+)
+from recommendation import STAGE_CUTOFFS, TARGET_COLS
+from recommendation_table import (
+    DAY_RANGE, REFERENCE_AREA, IRRIGATION_COUNTS as SERVED_COUNTS, representative_day
+)
+
+'''
+Exhaustive model check against the labelling rules.
+Every combination of the categorical inputs of both crops (soil, previous
+N/P/K, fertilizer and irrigation timing, irrigation level and the wheat
+irrigation counts 0-10 the app and service accept) is labelled with the vectorized rules
+of fast_generator.apply_rules (same as coding_wheat.py and
+rice_dataset_making.py) and scored with the model in large batches.
+Disagreements are grouped by feature combination.
+
+Days only matter to the rules through the growth stage, so every stage is
+checked at its representative day (--days mid) or at its first, middle and
+last training day (--days edges, 3x the rows). Area is fixed at the
+reference area. That is 171,072 wheat and 15,552 rice rows (--days mid).
+
+The sklearn model (model.joblib) is used: it scores big batches much faster
+than the flat forest, which is built for single requests.
+
+    python validate_model.py                    summary, worst feature values
+    python validate_model.py --output dis.csv   every disagreeing combination
+    python validate_model.py --min-agreement 0.98   exit 1 below, for retrain gates
+'''
+
+#every wheat irrigation count that can be served (training data only has 0-4)
+IRRIGATION_COUNTS = [c for c in SERVED_COUNTS if c >= 0]
+
+BATCH_ROWS = 65536
+
+#fast_generator code tables of the text columns
+CODE_TABLES = {
+    "growth_stage": STAGES,
+    "soil_type": SOILS,
+    "prev_N": PREV_LEVELS,
+    "prev_P": PREV_LEVELS,
+    "prev_K": PREV_LEVELS,
+    "time_since_last_fertilizer": FERT_TIMES,
+    "time_since_last_irrigation": IRR_TIMES,
+    "last_irrigation_level": IRR_LEVELS
+}
+
+#a disagreement is reported per combination of these
+GROUP_COLS = ["crop"] + list(CODE_TABLES) + ["irrigation_count"]
+
+
+def stage_days(crop, days="mid"):
+    # (day, stage code) pairs the model is checked at
+    early, mid = STAGE_CUTOFFS[crop]
+    bounds = [(DAY_RANGE[0], early), (early + 1, mid), (mid + 1, DAY_RANGE[1])]
+    pairs = []
+    for code, (low, high) in enumerate(bounds):
+        middle = representative_day(crop, STAGES[code])
+        for day in ([middle] if days == "mid" else sorted({low, middle, high})):
+            pairs.append((day, code))
+    return np.array(pairs)
+
+
+def enumerate_codes(crop, days="mid"):
+    # every combination for one crop as fast_generator code arrays
+    day_stage = stage_days(crop, days)
+    counts = np.array(IRRIGATION_COUNTS if crop == "wheat" else [-1])
+    sizes = [len(day_stage), 3, 4, 4, 4, 3, len(counts), 3, 3]
+    grid = np.indices(sizes).reshape(len(sizes), -1)
+    return {
+        "days": day_stage[grid[0], 0],
+        "stage": day_stage[grid[0], 1].astype(np.int8),
+        "soil": grid[1].astype(np.int8),
+        "prev_n": grid[2].astype(np.int8),
+        "prev_p": grid[3].astype(np.int8),
+        "prev_k": grid[4].astype(np.int8),
+        "fert_time": grid[5].astype(np.int8),
+        "irr_count": counts[grid[6]],
+        "irr_time": grid[7].astype(np.int8),
+        "irr_level": grid[8].astype(np.int8)
+    }
+
+
+def rule_labels(crop, codes):
+    # (rows, targets) rule levels as LEVELS codes
+    n, p, k = apply_rules(
+        crop, codes["stage"], codes["soil"], codes["prev_n"], codes["prev_p"],
+        codes["prev_k"], codes["fert_time"], codes["irr_time"], codes["irr_level"],
+        codes["irr_count"]
+    )
+    return np.column_stack([n, p, k])
+
+
+def to_frame(crop, codes):
+    # readable feature frame in model column order
+    columns = {
+        "crop": pd.Categorical.from_codes(np.zeros(len(codes["days"]), dtype=np.int8), [crop]),
+        "days_since_start": codes["days"],
+        "growth_stage": pd.Categorical.from_codes(codes["stage"], STAGES),
+        "soil_type": pd.Categorical.from_codes(codes["soil"], SOILS),
+        "prev_N": pd.Categorical.from_codes(codes["prev_n"], PREV_LEVELS),
+        "prev_P": pd.Categorical.from_codes(codes["prev_p"], PREV_LEVELS),
+        "prev_K": pd.Categorical.from_codes(codes["prev_k"], PREV_LEVELS),
+        "time_since_last_fertilizer": pd.Categorical.from_codes(codes["fert_time"], FERT_TIMES),
+        "irrigation_count": codes["irr_count"],
+        "time_since_last_irrigation": pd.Categorical.from_codes(codes["irr_time"], IRR_TIMES),
+        "last_irrigation_level": pd.Categorical.from_codes(codes["irr_level"], IRR_LEVELS),
+        "area_acres": REFERENCE_AREA
+    }
+    return pd.DataFrame(columns)
+
+
+def encode(df, encoder):
+    # model matrix straight from the categorical codes, no string matching per row
+    X = np.empty((len(df), len(encoder.columns)), dtype=np.float32)
+    for i, col in enumerate(encoder.columns):
+        if col in encoder.feature_classes:
+            values = df[col].cat.categories.astype(str)
+            lookup = pd.Index(encoder.feature_classes[col].astype(str)).get_indexer(values)
+            if (lookup < 0).any():
+                raise ValueError(f"Model does not know {col} {list(values[lookup < 0])}")
+            X[:, i] = lookup[df[col].cat.codes]
+        else:
+            X[:, i] = df[col]
+    return X
+
+
+def predict_codes(model, X, columns):
+    # model.joblib of any train_model.py layout, target codes (rows, targets)
+    out = np.empty((len(X), len(TARGET_COLS)), dtype=np.int64)
+    for start in range(0, len(X), BATCH_ROWS):
+        batch = pd.DataFrame(X[start:start + BATCH_ROWS], columns=columns)
+        if isinstance(model, dict):
+            # per crop models, routed on the crop column
+            pred = np.empty((len(batch), len(TARGET_COLS)), dtype=np.int64)
+            crop_codes = batch["crop"].to_numpy()
+            for code, (crop_model, crop_columns) in model.items():
+                rows = crop_codes == code
+                if rows.any():
+                    pred[rows] = crop_model.predict(batch.loc[rows, crop_columns])
+        else:
+            pred = model.predict(batch)
+        out[start:start + BATCH_ROWS] = pred
+    return out
+
+
+def validate(model, encoder, days="mid"):
+    # (fields, rule classes, model classes, differs) over every combination
+    frames, rules, models = [], [], []
+    target_index = [pd.Index(encoder.target_classes[c].astype(str)) for c in TARGET_COLS]
+    crop_codes = {c: i for i, c in enumerate(encoder.feature_classes["crop"].astype(str))}
+    if isinstance(model, dict):
+        model = {crop_codes[crop]: entry for crop, entry in model.items()}
+
+    for crop in ["wheat", "rice"]:
+        codes = enumerate_codes(crop, days)
+        df = to_frame(crop, codes)
+        levels = rule_labels(crop, codes)
+        # rule levels -> model target codes
+        rules.append(np.column_stack([
+            index.get_indexer(LEVELS)[levels[:, i]] for i, index in enumerate(target_index)
+        ]))
+        models.append(predict_codes(model, encode(df, encoder), encoder.columns))
+        frames.append(df)
+
+    fields = pd.concat(frames, ignore_index=True)
+    for col in GROUP_COLS:
+        if col != "irrigation_count":
+            fields[col] = fields[col].astype("category")
+    rules, models = np.concatenate(rules), np.concatenate(models)
+    classes = [np.asarray(encoder.target_classes[c]).astype(str) for c in TARGET_COLS]
+    rule_classes = pd.DataFrame(
+        {c: k[rules[:, i]] for i, (c, k) in enumerate(zip(TARGET_COLS, classes))}
+    )
+    model_classes = pd.DataFrame(
+        {c: k[models[:, i]] for i, (c, k) in enumerate(zip(TARGET_COLS, classes))}
+    )
+    return fields, rule_classes, model_classes, rules != models
+
+
+def summarize(fields, differs):
+    summary = {f"agree_{c}": float(1 - differs[:, i].mean()) for i, c in enumerate(TARGET_COLS)}
+    summary["agree_all"] = float(1 - differs.any(axis=1).mean())
+    summary["rows"] = len(fields)
+    summary["disagreeing_rows"] = int(differs.any(axis=1).sum())
+    return summary
+
+
+def disagreements(fields, rule_classes, model_classes, differs):
+    # one row per disagreeing feature combination, days it happens at and the classes
+    wrong = differs.any(axis=1)
+    df = fields.loc[wrong, GROUP_COLS + ["days_since_start"]].copy()
+    for col in TARGET_COLS:
+        df[f"rule_{col}"] = rule_classes.loc[wrong, col].to_numpy()
+        df[f"model_{col}"] = model_classes.loc[wrong, col].to_numpy()
+    keys = GROUP_COLS + [f"{s}_{c}" for c in TARGET_COLS for s in ["rule", "model"]]
+    grouped = df.groupby(keys, observed=True, sort=True)["days_since_start"]
+    out = grouped.agg(["size", "min", "max"]).rename(
+        columns={"size": "rows", "min": "from_day", "max": "to_day"}
+    )
+    return out.reset_index()
+
+
+def worst_values(fields, differs, top=15):
+    # disagreement rate of every single feature value, worst first
+    wrong = pd.Series(differs.any(axis=1), index=fields.index)
+    rates = []
+    for col in GROUP_COLS:
+        rate = wrong.groupby(fields[col], observed=True).mean()
+        rates += [(col, str(value), float(r)) for value, r in rate.items()]
+    out = pd.DataFrame(rates, columns=["feature", "value", "disagreement"])
+    return out.sort_values("disagreement", ascending=False).head(top)
+
+
+if __name__ == "__main__":
+    import joblib
+
+    parser = argparse.ArgumentParser(description="Check the model against the rules on every input")
+    parser.add_argument("--days", choices=["mid", "edges"], default="mid",
+                        help="stage midpoints, or first/middle/last training day of every stage")
+    parser.add_argument("--output", help="write every disagreeing combination to this csv")
+    parser.add_argument("--min-agreement", type=float,
+                        help="exit with status 1 when agree_all is below this")
+    args = parser.parse_args()
+
+    model = joblib.load("model.joblib")
+    encoder = joblib.load("compiled_encoder.joblib")
+
+    start = time.perf_counter()
+    fields, rule_classes, model_classes, differs = validate(model, encoder, args.days)
+    elapsed = time.perf_counter() - start
+
+    summary = summarize(fields, differs)
+    for name, value in summary.items():
+        print(f"{name:<20}{value:.4f}" if isinstance(value, float) else f"{name:<20}{value}")
+    print(f"checked in {elapsed:.1f} s")
+
+    table = disagreements(fields, rule_classes, model_classes, differs)
+    print(f"\n{len(table)} disagreeing combinations, worst feature values:")
+    print(worst_values(fields, differs).to_string(index=False))
+    if args.output:
+        table.to_csv(args.output, index=False)
+    elif len(table):
+        print(table.sort_values("rows", ascending=False).head(20).to_string(index=False))
+
+    if args.min_agreement is not None and summary["agree_all"] < args.min_agreement:
+        print(f"agreement {summary['agree_all']:.4f} below {args.min_agreement}")
+        sys.exit(1)